@@ -1,18 +1,22 @@
 # agents/llm_cluster_refiner.py
-import json
 from pathlib import Path
 from typing import Dict, Any, List
 
-from utils.file_loader import load_clusters
+from utils import fastjson
+from utils.file_loader import load_clusters, save_json
 from utils.llm import ask_json
 
 CLUSTERS_REFINED = Path("output") / "clusters_refined.json"
 
+# column order of the rows sent to the LLM
+COMPACT_KEYS = ["idx", "service", "java_class", "message", "count"]
+
 SYSTEM = """You are a log clustering assistant for an enterprise Java backend.
 
 You MUST respond with ONLY a single valid JSON object. No markdown, no backticks, no comments.
 
-You will receive a LIST of log clusters. Each cluster has:
+You will receive log clusters as a table: {"keys": [...], "rows": [[...], ...]}.
+Each row is one cluster, its values in the order given by "keys":
 - idx: numeric cluster index
 - service: service name (if available)
 - java_class: Java class or component name
@@ -40,14 +44,10 @@ Do NOT invent new idx values.
 
 USER_TEMPLATE = """You will receive multiple log clusters to refine.
 
-Each cluster has:
-- idx
-- service
-- java_class
-- message
-- count
+Each row is one cluster with values in this column order:
+idx, service, java_class, message, count
 
-Clusters (JSON list):
+Clusters (JSON table):
 {clusters_json}
 
 Group clusters that represent the same underlying logical error as described in the system prompt.
@@ -63,50 +63,39 @@ def run() -> Dict[str, Any]:
     clusters: List[Dict[str, Any]] = load_clusters()
 
     if not clusters:
-        CLUSTERS_REFINED.parent.mkdir(parents=True, exist_ok=True)
-        CLUSTERS_REFINED.write_text(json.dumps({"clusters": []}, indent=2), encoding="utf-8")
+        save_json(CLUSTERS_REFINED, {"clusters": []})
         return {"count": 0, "output": str(CLUSTERS_REFINED)}
 
-    # Prepare compact view for the LLM
-    compact: List[Dict[str, Any]] = []
-    for i, c in enumerate(clusters):
-        idx = i
-        compact.append(
-            {
-                "idx": idx,
-                "service": c.get("service") or c.get("athena_service"),
-                "java_class": c.get("java_class"),
-                "message": c.get("message"),
-                "count": c.get("count"),
-            }
-        )
+    # Prepare compact view for the LLM: one header row of keys instead of repeating
+    # every key per cluster, compact separators since indentation only costs tokens
+    compact: Dict[str, Any] = {
+        "keys": COMPACT_KEYS,
+        "rows": [
+            [i, c.get("service") or c.get("athena_service"), c.get("java_class"), c.get("message"), c.get("count")]
+            for i, c in enumerate(clusters)
+        ],
+    }
 
     user = USER_TEMPLATE.format(
-        clusters_json=json.dumps(compact, ensure_ascii=False, indent=2)
+        clusters_json=fastjson.dumps_str(compact)
     )
 
     out = ask_json(SYSTEM, user)
 
     # Fallback: if LLM output is bad, just copy original clusters
     if not isinstance(out, dict):
-        CLUSTERS_REFINED.parent.mkdir(parents=True, exist_ok=True)
-        CLUSTERS_REFINED.write_text(
-            json.dumps({"clusters": clusters}, indent=2, ensure_ascii=False),
-            encoding="utf-8",
-        )
+        save_json(CLUSTERS_REFINED, {"clusters": clusters})
         return {"count": len(clusters), "output": str(CLUSTERS_REFINED)}
 
     groups = out.get("groups")
     if not isinstance(groups, list) or not groups:
-        CLUSTERS_REFINED.parent.mkdir(parents=True, exist_ok=True)
-        CLUSTERS_REFINED.write_text(
-            json.dumps({"clusters": clusters}, indent=2, ensure_ascii=False),
-            encoding="utf-8",
-        )
+        save_json(CLUSTERS_REFINED, {"clusters": clusters})
         return {"count": len(clusters), "output": str(CLUSTERS_REFINED)}
 
     cluster_by_idx: Dict[int, Dict[str, Any]] = {}
     for i, c in enumerate(clusters):
+        # load_clusters() hands out a shared cached list; copy before re-indexing
+        c = dict(c)
         idx = c.get("idx")
         if idx is None:
             idx = i
@@ -128,11 +117,13 @@ def run() -> Dict[str, Any]:
 
         try:
             canonical_idx = int(canonical_idx)
-            member_idxs = [int(x) for x in member_idxs]
+            member_idxs = [
+                idx for idx in map(int, member_idxs)
+                if idx in cluster_by_idx and idx not in used_idxs
+            ]
         except (TypeError, ValueError):
             continue
 
-        member_idxs = [idx for idx in member_idxs if idx in cluster_by_idx and idx not in used_idxs]
         if not member_idxs:
             continue
 
@@ -140,10 +131,7 @@ def run() -> Dict[str, Any]:
 
         canonical = cluster_by_idx.get(canonical_idx) or cluster_by_idx[member_idxs[0]]
 
-        total_count = 0
-        for idx in member_idxs:
-            c = cluster_by_idx[idx]
-            total_count += c.get("count") or 0
+        total_count = sum(cluster_by_idx[idx].get("count") or 0 for idx in member_idxs)
 
         merged = dict(canonical)
         merged["count"] = total_count
@@ -151,18 +139,12 @@ def run() -> Dict[str, Any]:
 
         merged_clusters.append(merged)
 
-    all_idxs = set(cluster_by_idx.keys())
-    remaining = all_idxs - used_idxs
-    for idx in sorted(remaining):
+    for idx in sorted(cluster_by_idx.keys() - used_idxs):
         merged_clusters.append(cluster_by_idx[idx])
 
     for new_idx, c in enumerate(merged_clusters):
         c["idx"] = new_idx
 
-    CLUSTERS_REFINED.parent.mkdir(parents=True, exist_ok=True)
-    CLUSTERS_REFINED.write_text(
-        json.dumps({"clusters": merged_clusters}, indent=2, ensure_ascii=False),
-        encoding="utf-8",
-    )
+    save_json(CLUSTERS_REFINED, {"clusters": merged_clusters})
 
     return {"count": len(merged_clusters), "output": str(CLUSTERS_REFINED)}
@@ -1,14 +1,19 @@
 # agents/llm_confluence.py
-import json
+import os
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, Callable, List
 
-from utils.file_loader import load_jira_drafts, load_filter
+from utils import fastjson
+from utils.file_loader import load_jira_drafts, load_jira_drafts_json, load_filter, load_filter_json, save_text
 from utils.confluence_client import update_confluence_page_with_markdown
-from utils.llm import ask_json
+from utils.llm import ask_json, split_template, fill_template, truncate_items
 
 OUT = Path("output") / "confluence_draft.md"
 
+# per-section prompt budget; the report only shows ~10 rows, so a bad day with
+# thousands of drafts must not push the request into the long-context path
+PROMPT_MAX_CHARS = int(os.getenv("ALOE_CONFLUENCE_MAX_CHARS", "32000"))
+
 SYSTEM = """You are an assistant that writes concise Confluence-ready markdown reports
 summarizing an automated log review session in an enterprise Java backend.
 
@@ -60,6 +65,10 @@ Return ONLY:
 {{"markdown":"<markdown table as a JSON string with \\n between lines>"}}
 """
 
+# parsed once at import; run() only joins the payloads in
+USER_PARTS = split_template(USER_TEMPLATE)
+
+
 def _salvage_markdown_from_raw(raw: str) -> str:
     if not raw:
         return ""
@@ -71,7 +80,7 @@ def _salvage_markdown_from_raw(raw: str) -> str:
     if text.startswith("{") and text.endswith("}"):
         # If it returned {"something|...": "...."} (key is the table), salvage the key
         try:
-            obj = json.loads(text)
+            obj = fastjson.loads(text)
             # If valid JSON but wrong schema:
             if isinstance(obj, dict) and "markdown" not in obj and len(obj) == 1:
                 only_key = next(iter(obj.keys()))
@@ -96,14 +105,19 @@ def _salvage_markdown_from_raw(raw: str) -> str:
     return text
 
 
-def run() -> Dict[str, Any]:
+def _budgeted(text: str, load_items: Callable[[], List[Dict[str, Any]]]) -> str:
+    if len(text) <= PROMPT_MAX_CHARS:
+        return text
+    kept, omitted = truncate_items(load_items(), PROMPT_MAX_CHARS)
+    return f"{kept}\n(... and {omitted} more not shown)"
+
 
-    jira = load_jira_drafts()
-    filters_ = load_filter()
+def run() -> Dict[str, Any]:
 
-    user = USER_TEMPLATE.format(
-        jira_json=json.dumps(jira, ensure_ascii=False, indent=2),
-        filters_json=json.dumps(filters_, ensure_ascii=False, indent=2),
+    user = fill_template(
+        USER_PARTS,
+        jira_json=_budgeted(load_jira_drafts_json(), load_jira_drafts),
+        filters_json=_budgeted(load_filter_json(), load_filter),
     )
 
     out = ask_json(SYSTEM, user)
@@ -119,8 +133,7 @@ def run() -> Dict[str, Any]:
     if not markdown.strip():
         markdown = "| service name | short error summary | Jira ticket created | KQL exclusion filter | error count |\n| --- | --- | --- | --- | --- |"
 
-    OUT.parent.mkdir(parents=True, exist_ok=True)
-    OUT.write_text(markdown, encoding="utf-8")
+    save_text(OUT, markdown)
 
     update_confluence_page_with_markdown(markdown)
 
@@ -1,23 +1,37 @@
 # agents/llm_filter.py
-import json
+import os
+import re
 from pathlib import Path
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 
-from utils.file_loader import load_jira_drafts
-from utils.llm import ask_json
+from utils import fastjson
+from utils.file_loader import load_jira_drafts, save_json
+from utils.llm import ask_json_many, ask_json_batch, batch_enabled, cache_key, cache_get, cache_put, split_template, fill_template
 
 FILTER_OUTPUT = Path("output") / "filter_suggestions.json"
 
-BATCH_SIZE = 12
+# dynamic parts stripped from messages when deciding whether two drafts are the same error
+_UUID_RE = re.compile(r"\b[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}\b")
+_TS_RE = re.compile(r"\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(?:[.,]\d+)?Z?")
+_NUM_RE = re.compile(r"\b\d{4,}\b")
+_JAVA_FQN_RE = re.compile(r"\b(?:[a-z][a-z0-9_]*\.){2,}[A-Z][A-Za-z0-9_$]*\b")
+
+# anything the filter phrase must not contain: class names and per-occurrence values
+_DYNAMIC_RE = re.compile("|".join(r.pattern for r in (_JAVA_FQN_RE, _UUID_RE, _TS_RE, _NUM_RE)))
+_MIN_PHRASE_LEN = 4
+
+# longest stable fragment needed before a clause is built locally instead of asking the LLM
+_LOCAL_MIN_CHARS = 20
+
+# clusters per LLM request; larger batches mean fewer round-trips but slower responses
+BATCH_SIZE = int(os.getenv("ALOE_FILTER_BATCH_SIZE", "12"))
 
 SYSTEM = """You are a log filtering assistant for an enterprise backend system.
 
 Your task is to propose precise regex or Kibana KQL filters that:
 - Match the given error cluster reliably.
-- Generalize dynamic parts such as IDs, UUIDs, timestamps, numeric values.
 - Avoid over-matching unrelated logs.
 - Filter can contain a phrase fromt he error message
-- DO NOT include into KQL filter log the Java class name or exception name (e.g., com.knowledgeprice.athena.documents.api.DocumentGenerationService)
 - The filter should be specific to this error 
   (i.e., don't exclude the whole class name from the stack trace as some other error can occur in this class just in another place)
 - Include error message
@@ -77,6 +91,93 @@ Return a single JSON object with key "items" as described in the system prompt.
 If you cannot propose a safe filter for a cluster, you may omit it from the items list.
 """
 
+# parsed once at import; run() only joins the payloads in
+USER_PARTS = split_template(USER_TEMPLATE)
+
+
+def _canonical_message(message: Optional[str]) -> str:
+    text = _UUID_RE.sub("<uuid>", message or "")
+    text = _TS_RE.sub("<ts>", text)
+    return _NUM_RE.sub("<n>", text)
+
+
+def _sanitize_clause(clause: Any) -> Any:
+    """
+    Removes Java class names, UUIDs, timestamps and long numbers from match_phrase
+    'log' values. A phrase split by such parts becomes a bool/must of the remaining
+    fragments; a phrase with nothing stable left is dropped (None).
+    """
+    if not isinstance(clause, dict):
+        return clause
+
+    phrase = clause.get("match_phrase")
+    if isinstance(phrase, dict) and isinstance(phrase.get("log"), str):
+        fragments = [f.strip(" \t:;,.-=[]()'\"") for f in _DYNAMIC_RE.split(phrase["log"])]
+        fragments = [f for f in fragments if len(f) >= _MIN_PHRASE_LEN]
+        if not fragments:
+            return None
+        if len(fragments) == 1:
+            return {"match_phrase": {"log": fragments[0]}}
+        return {"bool": {"must": [{"match_phrase": {"log": f}} for f in fragments]}}
+
+    inner = clause.get("bool")
+    if isinstance(inner, dict):
+        cleaned: Dict[str, Any] = {}
+        for occur, subs in inner.items():
+            if isinstance(subs, list):
+                flat: List[Any] = []
+                for c in (_sanitize_clause(s) for s in subs):
+                    if c is None:
+                        continue
+                    # a split phrase inside a must list is merged into that list
+                    if occur == "must" and list(c) == ["bool"] and list(c["bool"]) == ["must"]:
+                        flat.extend(c["bool"]["must"])
+                    else:
+                        flat.append(c)
+                if not flat:
+                    continue
+                subs = flat
+            cleaned[occur] = subs
+        return {"bool": cleaned} if cleaned else None
+
+    return clause
+
+
+def _try_local_clause(payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Most filters are just the first message line minus its dynamic parts. Build that
+    directly when enough stable text is left; otherwise return None and let the LLM decide.
+    """
+    message = (payload.get("message") or "").strip()
+    if not message:
+        return None
+    first_line = message.split("\n\tat ", 1)[0].splitlines()[0]
+    clause = _sanitize_clause({"match_phrase": {"log": first_line}})
+    if clause is None:
+        return None
+    phrases = [clause] if "match_phrase" in clause else clause["bool"]["must"]
+    # at least one long fragment, so short generic pieces ("Error in") cannot over-match
+    if max(len(p["match_phrase"]["log"]) for p in phrases) < _LOCAL_MIN_CHARS:
+        return None
+    return clause
+
+
+def _cluster_payload(d: Dict[str, Any]) -> Dict[str, Any]:
+    cluster = d.get("cluster")
+    if isinstance(cluster, dict):
+        return cluster
+    # drafts written before the jira agent stored "cluster"
+    jira = d.get("jira") or {}
+    return {
+        "idx": d.get("idx"),
+        "service": d.get("service") or jira.get("service_name") or (d.get("triage") or {}).get("service"),
+        "java_class": d.get("java_class"),
+        "message": jira.get("message") or jira.get("stack_trace_excerpt"),
+        "count": d.get("count"),
+        "triage": d.get("triage"),
+    }
+
+
 def _chunked(seq: List[Any], size: int):
     for i in range(0, len(seq), size):
         yield seq[i : i + size]
@@ -87,84 +188,92 @@ def run() -> Dict[str, Any]:
     drafts = load_jira_drafts()
 
     if not drafts:
-        FILTER_OUTPUT.parent.mkdir(parents=True, exist_ok=True)
-        FILTER_OUTPUT.write_text(json.dumps({"suggestions": []}, indent=2), encoding="utf-8")
+        save_json(FILTER_OUTPUT, {"suggestions": []}, indent=2)
         return {"count": 0, "output": str(FILTER_OUTPUT)}
 
     clauses_by_idx: Dict[Any, Any] = {}
 
-    for batch in _chunked(drafts, BATCH_SIZE):
-        cluster_payloads: List[Dict[str, Any]] = []
-
-        for d in batch:
-
-            cluster_idx = d.get("idx")
-            cluster_payloads.append(
-                {
-                    "idx": cluster_idx,
-                    "service": d.get("service") or d.get("jira").get("service_name") or d.get("triage").get("service"),
-                    "java_class": d.get("java_class"),
-                    "message": d.get("jira").get("message") or d.get("jira").get("stack_trace_excerpt"),
-                    "count": d.get("count"),
-                    "triage": d.get("triage"),
-                }
-            )
-
-        user = USER_TEMPLATE.format(
-            clusters_json=json.dumps(cluster_payloads, ensure_ascii=False, indent=2)
-        )
-
-        out = ask_json(SYSTEM, user)
-
-        if not isinstance(out, dict):
+    # Clauses are cached per cluster (not per batch), so a rerun only asks the LLM
+    # about clusters whose content changed. idx and count are positional/volatile
+    # and left out of the key.
+    # Drafts of the same error (same service/class, message equal up to IDs and
+    # timestamps) share one LLM request; the clause is fanned out to all members below.
+    pending: List[Dict[str, Any]] = []
+    key_by_idx: Dict[Any, str] = {}
+    groups: Dict[Any, List[Any]] = {}
+    # built once and shared by the request and the suggestion loops
+    payloads = [_cluster_payload(d) for d in drafts]
+    for payload in payloads:
+        cluster_idx = payload.get("idx")
+        dedup_key = (payload.get("service"), payload.get("java_class"), _canonical_message(payload.get("message")))
+        members = groups.get(dedup_key)
+        if members is not None:
+            members.append(cluster_idx)
             continue
+        groups[dedup_key] = [cluster_idx]
 
-        items = out.get("items") or []
-        if not isinstance(items, list):
+        local = _try_local_clause(payload)
+        if local is not None:
+            clauses_by_idx[cluster_idx] = local
             continue
 
-        for it in items:
-            if not isinstance(it, dict):
-                continue
-            idx = it.get("idx")
-            if idx is None:
-                continue
-            es_clause = it.get("es_filter_clause")
-            if es_clause is None:
+        key = cache_key("filter", SYSTEM, {k: v for k, v in payload.items() if k not in ("idx", "count")})
+        cached = cache_get(key)
+        if cached is not None:
+            clauses_by_idx[cluster_idx] = cached
+            continue
+        key_by_idx[cluster_idx] = key
+        pending.append(payload)
+
+    # batches are independent, so they go out concurrently (or as one Batch API job);
+    # responses come back in batch order. A batch whose response is unusable (failed
+    # request, malformed JSON, no "items" list) is halved and resent live, so one odd
+    # cluster does not cost the whole batch its clauses.
+    batches = list(_chunked(pending, BATCH_SIZE))
+    ask = ask_json_batch if batch_enabled() else ask_json_many
+    while batches:
+        user_prompts = [fill_template(USER_PARTS, clusters_json=fastjson.dumps_str(batch)) for batch in batches]
+        retry: List[List[Dict[str, Any]]] = []
+        for batch, out in zip(batches, ask(SYSTEM, user_prompts, cache=False)):
+            items = out.get("items") if isinstance(out, dict) else None
+            if not isinstance(items, list):
+                if len(batch) > 1:
+                    half = len(batch) // 2
+                    retry.extend((batch[:half], batch[half:]))
                 continue
-            clauses_by_idx[idx] = es_clause
-
-    suggestions: List[Dict[str, Any]] = []
-
-    for d in drafts:
-        cluster_payload = d.get("cluster") or {
-            "idx": d.get("idx"),
-            "service": d.get("service"),
-            "java_class": d.get("java_class"),
-            "message": d.get("message"),
-            "count": d.get("count"),
-            "triage": d.get("triage"),
-        }
-
-        cluster_idx = d.get("idx") or cluster_payload.get("idx")
-        es_clause = clauses_by_idx.get(cluster_idx)
 
-        if not es_clause:
-            continue
+            for it in items:
+                if not isinstance(it, dict):
+                    continue
+                idx = it.get("idx")
+                if idx is None:
+                    continue
+                es_clause = _sanitize_clause(it.get("es_filter_clause"))
+                if es_clause is None:
+                    continue
+                clauses_by_idx[idx] = es_clause
+                if not out.get("_partial"):
+                    cache_put(key_by_idx.get(idx), es_clause)
+        batches = retry
+        ask = ask_json_many
+
+    for members in groups.values():
+        es_clause = clauses_by_idx.get(members[0])
+        if es_clause is not None:
+            for idx in members[1:]:
+                clauses_by_idx[idx] = es_clause
+
+    suggestions: List[Dict[str, Any]] = [
+        {
+            "idx": cp.get("idx"),
+            "service": cp.get("service"),
+            "count": cp.get("count"),
+            "es_filter_clause": clauses_by_idx[cp.get("idx")],
+        }
+        for cp in payloads
+        if clauses_by_idx.get(cp.get("idx"))
+    ]
 
-        suggestions.append(
-            {
-                "idx": cluster_idx,
-                "service": cluster_payload.get("service"),
-                "count": cluster_payload.get("count"),
-                "es_filter_clause": es_clause,
-            }
-        )
-
-    FILTER_OUTPUT.parent.mkdir(parents=True, exist_ok=True)
-    FILTER_OUTPUT.write_text(
-        json.dumps({"suggestions": suggestions}, indent=2, ensure_ascii=False),
-        encoding="utf-8"
-    )
+    save_json(FILTER_OUTPUT, {"suggestions": suggestions}, indent=2)
 
     return {"count": len(suggestions), "output": str(FILTER_OUTPUT)}
\ No newline at end of file
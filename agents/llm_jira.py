@@ -1,14 +1,45 @@
 # agents/jira_drafts.py
-import json
-from pathlib import Path
-from typing import Dict, Any, List, Optional
-
-from utils.file_loader import load_triaged
+import hashlib
+import os
+import random
+import re
+import time
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+
+from utils import fastjson
+from utils.file_loader import (
+    load_triaged, save_json, ensure_parent_dir,
+    JIRA_DRAFTS, JIRA_DRAFTS_NDJSON, JIRA_DRAFTS_SUMMARY,
+)
 from utils.jira_client import create_jira_issues
-from utils.llm import ask_json
+from utils.llm import ask_json_many, ask_json_batch, batch_enabled, cache_key, cache_get, cache_put
 
-JIRA_OUTPUT = Path("output") / "jira_drafts.json"
+JIRA_OUTPUT = JIRA_DRAFTS_NDJSON
 BATCH_SIZE = 10
+# input budget per request; clusters with long stack traces get smaller batches
+BATCH_MAX_TOKENS = int(os.getenv("ALOE_JIRA_BATCH_TOKENS", "6000"))
+
+# also write the old combined jira_drafts.json for external tooling that still reads it
+LEGACY_OUTPUT = os.getenv("ALOE_JIRA_LEGACY_OUTPUT", "0") == "1"
+
+# Opt-in rule pre-filter: clusters the triage already marked as not worth a ticket are
+# skipped without an LLM call. Off by default because the filter agent builds its
+# suggestions from the drafts, so skipped clusters also get no filter suggestion.
+LOCAL_PREFILTER = os.getenv("ALOE_JIRA_PREFILTER", "0") == "1"
+PREFILTER_MIN_COUNT = 3
+
+# a batch whose response is unusable (malformed JSON, missing "items", failed request)
+# is sent again, after 0.25s and then 1s (plus jitter), before its clusters are skipped
+BATCH_ATTEMPTS = 3
+BATCH_RETRY_BASE = 0.25
+
+# frames kept from the top of each stack_excerpt (the model only needs where it failed)
+STACK_KEEP_FRAMES = 5
+_AT_RE = re.compile(r"^\s*at\s+")
+_CAUSED_BY_RE = re.compile(r"^\s*Caused by:")
+
+# Drafts are cached per cluster across runs; recurring errors reuse last week's draft.
+DRAFT_CACHE_TTL = 7 * 24 * 3600
 
 SYSTEM = """You are a senior backend engineer writing Jira bug tickets for Java backend services.
 
@@ -52,169 +83,333 @@ You must return a single JSON object with key "items".
 - "message": exact error message from the stack trace (include Caused by)
 """
 
+# The cluster payload goes last: everything before it is byte-identical across batches,
+# so the provider's automatic prefix cache can reuse SYSTEM + these instructions.
 USER_TEMPLATE = """Here is the list of log clusters and triage info.
 
 The logs for these clusters were collected over approximately 24 hours.
 
-Clusters:
-{clusters_json}
-
 For EACH cluster in this list, produce one Jira draft object as described in the system prompt.
 Return a single JSON object with key "items" as specified.
+
+Clusters:
+{clusters_json}
 """
 
-def _chunked(seq: List[Any], size: int) -> List[List[Any]]:
-    for i in range(0, len(seq), size):
-        yield seq[i : i + size]
+# the prompt text only changes between releases, so it enters the per-cluster cache
+# key as one precomputed digest instead of being re-serialized for every cluster
+_PROMPT_DIGEST = hashlib.blake2b((SYSTEM + USER_TEMPLATE).encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _draft_cache_key(it: Dict[str, Any]) -> str:
+    stack = it.get("stack_excerpt") or ""
+    return cache_key(
+        "jira",
+        _PROMPT_DIGEST,
+        it.get("signature"),
+        hashlib.blake2b(stack.encode("utf-8"), digest_size=16).hexdigest(),
+        (it.get("triage") or {}).get("label"),
+    )
+
+
+def _write_summary(draft_count: int, skipped: List[Dict[str, Any]]) -> None:
+    save_json(
+        JIRA_DRAFTS_SUMMARY,
+        {
+            "draft_count": draft_count,
+            "skipped_count": len(skipped),
+            "skipped": skipped,
+        },
+        indent=2,
+    )
+
+
+def _write_legacy(drafts: List[Dict[str, Any]], skipped: List[Dict[str, Any]]) -> None:
+    save_json(
+        JIRA_DRAFTS,
+        {
+            "draft_count": len(drafts),
+            "skipped_triaged_issues_count": len(skipped),
+            "drafts": drafts,
+            "skipped": skipped,
+        },
+        indent=2,
+    )
+
+
+def _local_reject_reason(it: Dict[str, Any]) -> Optional[str]:
+    triage = it.get("triage") or {}
+    label = triage.get("label")
+    severity = triage.get("severity")
+    if severity == "high":
+        return None
+    if label == "noise" and triage.get("priority") == "low":
+        return "local rule: low-priority noise"
+    if (it.get("count") or 0) < PREFILTER_MIN_COUNT and label != "internal_error":
+        return f"local rule: fewer than {PREFILTER_MIN_COUNT} hits"
+    return None
+
+
+def _trim_stack(excerpt: Optional[str], keep: int = STACK_KEEP_FRAMES) -> Optional[str]:
+    """
+    Keeps the exception header, the first `keep` frames and every "Caused by" line
+    with the frame right after it; other frames and "... N more" lines are dropped.
+    """
+    if not excerpt:
+        return excerpt
+    out: List[str] = []
+    frames = 0
+    after_cause = False
+    for line in excerpt.splitlines():
+        if _AT_RE.match(line):
+            if frames < keep or after_cause:
+                out.append(line)
+            frames += 1
+            after_cause = False
+        elif _CAUSED_BY_RE.match(line):
+            out.append(line)
+            after_cause = True
+        elif frames == 0:
+            out.append(line)
+    return "\n".join(out)
+
+
+def _cluster_payload(it: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "idx": it.get("idx"),
+        "signature": it.get("signature"),
+        "service": it.get("service"),
+        "java_class": it.get("java_class"),
+        "message": it.get("message"),
+        "count": it.get("count"),
+        "triage": it.get("triage"),
+        "stack_excerpt": _trim_stack(it.get("stack_excerpt")),
+    }
+
+
+def _estimate_tokens(payload_json: str) -> int:
+    # ~4 characters per token is close enough for batching; no tokenizer dependency
+    return len(payload_json) // 4
+
+
+def _chunked_by_tokens(
+    seq: List[Tuple[Dict[str, Any], str]],
+    max_tokens: int = BATCH_MAX_TOKENS,
+    max_items: int = BATCH_SIZE,
+) -> Iterator[List[Tuple[Dict[str, Any], str]]]:
+    cur: List[Tuple[Dict[str, Any], str]] = []
+    tokens = 0
+    for it in seq:
+        t = _estimate_tokens(it[1])
+        if cur and (tokens + t > max_tokens or len(cur) >= max_items):
+            yield cur
+            cur, tokens = [], 0
+        cur.append(it)
+        tokens += t
+    if cur:
+        yield cur
+
+def _batch_prompt(batch: List[Tuple[Dict[str, Any], str]]) -> str:
+    return USER_TEMPLATE.format(clusters_json="[" + ",".join(text for _, text in batch) + "]")
+
+
+def _batch_drafts(out: Any, batch: List[Dict[str, Any]]) -> Tuple[Dict[Any, Dict[str, Any]], Optional[str]]:
+    """
+    Checks one batch response against the expected {"items": [{"idx": ..., ...}]} shape.
+    Returns the drafts by idx, or an empty dict and the reason the whole batch failed
+    (also when none of the returned items belongs to the batch).
+    A single-cluster batch may also come back as the bare draft object.
+    """
+    if not isinstance(out, dict):
+        return {}, "LLM output not a dict"
+    if out.get("_error"):
+        return {}, f"LLM request failed: {out['_error']}"
+    items_out = out.get("items")
+    if items_out is None:
+        if len(batch) == 1:
+            return {batch[0].get("idx"): out}, None
+        return {}, "no 'items' field in LLM output for batch"
+    if not isinstance(items_out, list):
+        return {}, "'items' is not a list in LLM output"
+    # idx is matched as text, so "3" and 3 both resolve to cluster 3; items for
+    # clusters that were not in this batch are dropped
+    batch_idx = {str(it.get("idx")): it.get("idx") for it in batch}
+    found = {}
+    for ji in items_out:
+        if isinstance(ji, dict) and str(ji.get("idx")) in batch_idx:
+            idx = batch_idx[str(ji.get("idx"))]
+            found[idx] = {**ji, "idx": idx}
+    if not found:
+        return {}, "no drafts for this batch's clusters in LLM output"
+    return found, None
+
 
 def run(cluster_indices: Optional[List[int]] = None, mode: str = "orchestrator") -> Dict[str, Any]:
     items = load_triaged()
 
+    selected: List[Dict[str, Any]] = []
+    skipped: List[Dict[str, Any]] = []
     if mode == "pipeline":
-        selected = list(items)
-        skipped: List[Dict[str, Any]] = []
+        # read-only below, so the loaded list is used as is
+        selected = items
     else:
         idx_set = set(cluster_indices or [])
-        selected = [it for it in items if it.get("idx") in idx_set]
-        skipped = [
-            {
-                "idx": it.get("idx"),
-                "reason": "not selected",
-                "triage": it.get("triage"),
-            }
-            for it in items
-            if it.get("idx") not in idx_set
-        ]
+        for it in items:
+            idx = it.get("idx")
+            if idx in idx_set:
+                selected.append(it)
+            else:
+                skipped.append({"idx": idx, "reason": "not selected", "triage": it.get("triage")})
+
+    if LOCAL_PREFILTER:
+        kept: List[Dict[str, Any]] = []
+        for it in selected:
+            reason = _local_reject_reason(it)
+            if reason is None:
+                kept.append(it)
+            else:
+                skipped.append({"idx": it.get("idx"), "reason": reason, "triage": it.get("triage")})
+        selected = kept
 
     drafts: List[Dict[str, Any]] = []
 
     if not selected:
-        JIRA_OUTPUT.parent.mkdir(parents=True, exist_ok=True)
-        JIRA_OUTPUT.write_text(
-            json.dumps(
-                {
-                    "draft_count": 0,
-                    "skipped_count": len(items),
-                    "drafts": [],
-                    "skipped": [
-                        {"idx": it.get("idx"), "reason": "not selected"}
-                        for it in items
-                    ],
-                },
-                indent=2,
-                ensure_ascii=False,
-            ),
-            encoding="utf-8",
-        )
+        ensure_parent_dir(JIRA_OUTPUT)
+        JIRA_OUTPUT.write_bytes(b"")
+        _write_summary(0, skipped)
+        if LEGACY_OUTPUT:
+            _write_legacy(drafts, skipped)
         return {"count": 0, "output": str(JIRA_OUTPUT)}
 
     jira_by_idx: Dict[Any, Dict[str, Any]] = {}
 
-    for batch in _chunked(selected, BATCH_SIZE):
-        cluster_payloads: List[Dict[str, Any]] = []
-        for it in batch:
-            cluster_payloads.append(
-                {
-                    "idx": it.get("idx"),
-                    "signature": it.get("signature"),
-                    "service": it.get("service"),
-                    "java_class": it.get("java_class"),
-                    "message": it.get("message"),
-                    "count": it.get("count"),
-                    "triage": it.get("triage"),
-                    "stack_excerpt": it.get("stack_excerpt"),
-                }
-            )
-
-        user = USER_TEMPLATE.format(
-            clusters_json=json.dumps(cluster_payloads, ensure_ascii=False, indent=2))
+    # Clusters with the same signature (one root cause split across clusters) get one
+    # LLM draft; it is copied to the other members once the representatives are done.
+    groups: Dict[Any, List[Dict[str, Any]]] = {}
+    for it in selected:
+        sig = it.get("signature") or f"{it.get('java_class')}|{(it.get('message') or '')[:120]}"
+        groups.setdefault(sig, []).append(it)
+
+    misses: List[Dict[str, Any]] = []
+    key_by_idx: Dict[Any, str] = {}
+    for members in groups.values():
+        it = members[0]
+        key = _draft_cache_key(it)
+        cached = cache_get(key, max_age=DRAFT_CACHE_TTL)
+        if isinstance(cached, dict):
+            # the draft text is reused, but idx and frequency belong to this run
+            jira_by_idx[it.get("idx")] = {
+                **cached,
+                "idx": it.get("idx"),
+                "hits_past_window": f"{it.get('count')} hits in past 24 hours",
+            }
+            continue
+        key_by_idx[it.get("idx")] = key
+        misses.append(it)
+
+    # each cluster is projected and serialized once; the same text sizes the batch
+    # and is spliced into the prompt (a JSON array is just the items joined by commas)
+    packed = [(it, fastjson.dumps_str(_cluster_payload(it))) for it in misses]
+
+    def _send(
+            batches: List[List[Tuple[Dict[str, Any], str]]],
+            ask=ask_json_many,
+    ) -> List[Tuple[List[Tuple[Dict[str, Any], str]], str]]:
+        # all batches are sent concurrently; returns the ones that failed, with the reason
+        failed = []
+        outs = ask(SYSTEM, [_batch_prompt(b) for b in batches], cache=False)
+        for batch, out in zip(batches, outs):
+            found, error = _batch_drafts(out, [it for it, _ in batch])
+            if error is not None:
+                failed.append((batch, error))
+                continue
+            # drafts from a truncated reply are used but not cached
+            cacheable = not (isinstance(out, dict) and out.get("_partial"))
+            for idx, ji in found.items():
+                jira_by_idx[idx] = ji
+                if cacheable:
+                    cache_put(key_by_idx.get(idx), ji)
+        return failed
+
+    pending = list(_chunked_by_tokens(packed))
+    failed: List[Tuple[List[Tuple[Dict[str, Any], str]], str]] = []
+    for attempt in range(BATCH_ATTEMPTS):
+        if attempt:
+            time.sleep(BATCH_RETRY_BASE * 4 ** (attempt - 1) * (1 + random.random() * 0.25))
+        # the first round may go out as one Batch API job; retries are few and go live
+        failed = _send(pending, ask_json_batch if batch_enabled() and not attempt else ask_json_many)
+        if not failed:
+            break
+        pending = [batch for batch, _ in failed]
+
+    # A batch that keeps failing is usually one bad cluster (huge or odd stack trace):
+    # halve it until the failing clusters are isolated, so the rest still get drafts.
+    while any(len(batch) > 1 for batch, _ in failed):
+        halves = [
+            half
+            for batch, _ in failed if len(batch) > 1
+            for half in (batch[: len(batch) // 2], batch[len(batch) // 2 :])
+        ]
+        failed = [f for f in failed if len(f[0]) == 1] + _send(halves)
 
-        out = ask_json(SYSTEM, user)
+    for batch, error in failed:
+        skipped.extend(
+            {"idx": it.get("idx"), "reason": error, "triage": it.get("triage")}
+            for it, _ in batch
+        )
 
-        if not isinstance(out, dict):
-            for it in batch:
-                skipped.append(
-                    {
-                        "idx": it.get("idx"),
-                        "reason": "LLM output not a dict",
-                        "triage": it.get("triage"),
-                    }
-                )
+    for members in groups.values():
+        rep_jira = jira_by_idx.get(members[0].get("idx"))
+        if rep_jira is None:
             continue
+        for it in members[1:]:
+            jira_by_idx[it.get("idx")] = {
+                **rep_jira,
+                "idx": it.get("idx"),
+                "service_name": it.get("service") or rep_jira.get("service_name"),
+                "hits_past_window": f"{it.get('count')} hits in past 24 hours",
+            }
 
-        items_out = out.get("items")
-        if items_out is None:
-            if len(batch) == 1:
-                jira_by_idx[batch[0].get("idx")] = out
-            else:
-                for it in batch:
-                    skipped.append(
-                        {
-                            "idx": it.get("idx"),
-                            "reason": "no 'items' field in LLM output for batch",
-                            "triage": it.get("triage"),
-                        }
-                    )
-            continue
+    # one draft per line, written as it is built: a crash keeps everything drafted so far
+    ensure_parent_dir(JIRA_OUTPUT)
+    with JIRA_OUTPUT.open("wb", buffering=1 << 20) as f:
+        for it in selected:
+            idx = it.get("idx")
+            jira = jira_by_idx.get(idx)
 
-        if not isinstance(items_out, list):
-            for it in batch:
+            if jira is None:
                 skipped.append(
                     {
-                        "idx": it.get("idx"),
-                        "reason": "'items' is not a list in LLM output",
+                        "idx": idx,
+                        "reason": "no Jira draft returned for this idx",
                         "triage": it.get("triage"),
                     }
                 )
-            continue
-
-        for ji in items_out:
-            if not isinstance(ji, dict):
                 continue
-            idx = ji.get("idx")
-            if idx is None:
-                continue
-            jira_by_idx[idx] = ji
 
-    for it in selected:
-        idx = it.get("idx")
-        jira = jira_by_idx.get(idx)
-
-        if jira is None:
-            skipped.append(
-                {
-                    "idx": idx,
-                    "reason": "no Jira draft returned for this idx",
-                    "triage": it.get("triage"),
-                }
-            )
-            continue
-
-        drafts.append(
-            {
+            draft = {
                 "idx": idx,
                 "signature": it.get("signature"),
                 "java_class": it.get("java_class"),
                 "count": it.get("count"),
                 "triage": it.get("triage"),
                 "jira": jira,
+                # canonical cluster view read by the filter/confluence/review steps
+                "cluster": {
+                    "idx": idx,
+                    "service": it.get("service") or jira.get("service_name"),
+                    "java_class": it.get("java_class"),
+                    "message": it.get("message") or jira.get("message") or jira.get("stack_trace_excerpt"),
+                    "count": it.get("count"),
+                    "triage": it.get("triage"),
+                },
             }
-        )
+            f.write(fastjson.dumps(draft) + b"\n")
+            drafts.append(draft)
 
-    JIRA_OUTPUT.parent.mkdir(parents=True, exist_ok=True)
-    JIRA_OUTPUT.write_text(
-        json.dumps(
-            {
-                "draft_count": len(drafts),
-                "skipped_triaged_issues_count": len(skipped),
-                "drafts": drafts,
-                "skipped": skipped,
-            },
-            indent=2,
-            ensure_ascii=False,
-        ),
-        encoding="utf-8",
-    )
+    _write_summary(len(drafts), skipped)
+    if LEGACY_OUTPUT:
+        _write_legacy(drafts, skipped)
 
     create_jira_issues(drafts)
 
@@ -1,11 +1,16 @@
 # agents/llm_orchestrator.py
-import json
-from typing import Dict, Any, List
+import asyncio
+import os
+import sys
+from functools import lru_cache
+from typing import Callable, Dict, Any, List, Optional, Tuple
 
-from utils.file_loader import load_feedback
-from utils.llm import ask_json
+from utils import fastjson
+from utils.file_loader import load_feedback, FEEDBACK
+from utils.llm import ask_json, ask_json_async, ask_json_many, new_async_client
+from utils.metrics import add_fast_path_plan
 
-SYSTEM = SYSTEM = """You are an orchestration planner for a multi-agent log review system in an enterprise Java backend.
+SYSTEM = """You are an orchestration planner for a multi-agent log review system in an enterprise Java backend.
 
 Available agents:
 - JIRA_AGENT: generates Jira bug ticket drafts from important log clusters.
@@ -24,7 +29,8 @@ Important dependencies between agents:
 
 Your job:
 - Read the summary of the triaged log clusters.
-- Inspect individual triaged clusters.
+- Inspect individual triaged clusters. They come as a table: {"keys": [...], "rows": [[...], ...]};
+  each row is one cluster, its values in the order given by "keys".
 - Decide which agents to run this time.
 - For JIRA_AGENT, explicitly choose which cluster indices should be turned into tickets.
 - For each agent, optionally specify parameters (e.g. limits, thresholds).
@@ -43,9 +49,9 @@ Guidelines:
 - Use both the numeric summary fields, the per-cluster triage information, and any feedback to decide.
 
 Feedback:
-- Some clusters may contain a 'feedback' field with previous human decisions:
-  - decision: 'approved' means tickets for this signature were useful.
-  - decision: 'rejected' means tickets for this signature were noise.
+- The 'feedback' column holds previous human decisions (null when not reviewed):
+  - 'approved' means tickets for this signature were useful.
+  - 'rejected' means tickets for this signature were noise.
 - In general, you should NOT propose JIRA_AGENT again for clusters that already have feedback
   (approved or rejected), because they have already been reviewed.
 - If all clusters already have feedback and nothing important changed, you may skip JIRA_AGENT
@@ -64,147 +70,351 @@ Trade-offs:
 - If there are many severe internal_error clusters, prioritize JIRA_AGENT and CONFLUENCE_AGENT.
 - If there are few or no internal_error clusters but many timeout/external_service clusters, prioritize FILTER_AGENT and possibly skip JIRA_AGENT.
 - If almost nothing happened (few clusters, mostly low severity), you may skip all agents or only run CONFLUENCE_AGENT with a short 'no critical issues' note.
-"""
-
-USER_TEMPLATE = """Here is the current summary of the log review state:
-
-{summary_json}
-
-Here are the triaged clusters (each with idx and triage info):
-
-{clusters_json}
-
-Decide which agents to run next and with which policies.
 
 Return JSON with this exact schema:
-{{
+{
   "actions": [
-    {{
+    {
       "agent": "JIRA_AGENT",
       "run": true or false,
       "cluster_indices": [<int> or empty list]
-    }},
-    {{
+    },
+    {
       "agent": "FILTER_AGENT",
       "run": true or false,
       "for_labels": ["timeout", "external_service", "noise"],
       "min_count": <int or null>
-    }},
-    {{
+    },
+    {
       "agent": "CONFLUENCE_AGENT",
       "run": true or false
-    }}
+    }
   ],
-  "global_policy": {{
+  "global_policy": {
     "ticket_strategy": "aggressive"|"balanced"|"conservative",
     "noise_handling": "none"|"basic_filters"|"aggressive_filters"
-  }},
+  },
   "reason": "short explanation of your decision"
-}}
+}
 """
 
+# Only run data here; instructions and the response schema live in SYSTEM, which
+# is byte-identical on every call so the provider's prefix cache can reuse it.
+USER_TEMPLATE = """Decide which agents to run next and with which policies.
+Return JSON matching the schema from the system prompt.
+
+Here is the current summary of the log review state:
+
+{summary_json}
+
+Here are the triaged clusters (table of keys and rows):
+
+{clusters_json}
+"""
+
+
+# A response for the exact same summary, clusters and feedback is reused from the LLM
+# cache for this long; after that the plan is asked for again.
+PLAN_CACHE_TTL = float(os.getenv("ALOE_PLAN_CACHE_TTL", "3600"))
 
-def _compact_clusters(triaged_items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    compact: List[Dict[str, Any]] = []
-    for it in triaged_items:
-        triage = it.get("triage", {})
-        compact.append(
-            {
-                "idx": it.get("idx"),
-                "signature": it.get("signature"),
-                "service": it.get("service"),
-                "label": triage.get("label"),
-                "priority": triage.get("priority"),
-                "severity": triage.get("severity"),
-                "confidence": triage.get("confidence"),
-                "count": it.get("count"),
-                "java_class": it.get("java_class"),
-                "message": it.get("message"),
-            }
-        )
-    return compact
-
-
-def plan_actions(summary: Dict[str, Any], triaged_items: List[Dict[str, Any]], use_feedback: bool = True) -> Dict[str, Any]:
-    compact_clusters = _compact_clusters(triaged_items)
-    feedback_entries = load_feedback()
-
-    fb_by_sig = {}
-    if use_feedback:
-        for fb in feedback_entries:
-            sig = fb.get("signature")
-            if not sig:
+# Allowed keys and defaults per agent; plan_actions() keeps only these keys from the
+# LLM output, and an agent missing here is dropped from the plan.
+AGENT_SCHEMAS: Dict[str, Dict[str, Any]] = {
+    "JIRA_AGENT": {"run": False, "cluster_indices": []},
+    "FILTER_AGENT": {"run": False, "for_labels": ["timeout", "external_service", "noise"], "min_count": None},
+    "CONFLUENCE_AGENT": {"run": False},
+}
+
+# Shape a plan response must have to be cached (checked when fastjsonschema is
+# installed). Field values are still coerced per action by _normalize_action.
+PLAN_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "required": ["actions"],
+    "properties": {
+        "actions": {
+            "type": "array",
+            "items": {"type": "object", "required": ["agent"]},
+        },
+    },
+}
+
+
+def _as_bool(v: Any) -> bool:
+    # the model sometimes quotes booleans; bool("false") would be True
+    if isinstance(v, str):
+        return v.strip().lower() in ("true", "yes", "1")
+    return bool(v)
+
+
+def _as_int_list(v: Any) -> List[int]:
+    if not isinstance(v, list):
+        raise ValueError(v)
+    return [int(x) for x in v if isinstance(x, (int, str)) and str(x).strip().lstrip("-").isdigit()]
+
+
+def _as_str_list(v: Any) -> List[str]:
+    if not isinstance(v, list):
+        raise ValueError(v)
+    return [x for x in v if isinstance(x, str)]
+
+
+def _as_opt_int(v: Any) -> Optional[int]:
+    return None if v is None else int(v)
+
+
+# type coercion per action field; a value that cannot be coerced falls back to the default
+FIELD_TYPES: Dict[str, Callable[[Any], Any]] = {
+    "run": _as_bool,
+    "cluster_indices": _as_int_list,
+    "for_labels": _as_str_list,
+    "min_count": _as_opt_int,
+}
+
+
+def _normalize_action(a: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    agent = a.get("agent")
+    schema = AGENT_SCHEMAS.get(agent)
+    if schema is None:
+        return None
+    action: Dict[str, Any] = {"agent": agent}
+    for k, default in schema.items():
+        v = a.get(k)
+        if v is not None:
+            try:
+                action[k] = FIELD_TYPES[k](v)
                 continue
-            fb_by_sig[sig] = {
-                "decision": fb.get("decision"),
-            }
+            except (TypeError, ValueError):
+                pass
+        action[k] = list(default) if isinstance(default, list) else default
+    return action
+
+
+@lru_cache(maxsize=1)
+def _feedback_index_cached(mtime_ns: int, size: int) -> Dict[str, Dict[str, Any]]:
+    return {
+        fb["signature"]: {"decision": fb.get("decision")}
+        for fb in load_feedback()
+        if fb.get("signature")
+    }
 
-        for c in compact_clusters:
-            sig = c.get("signature")
-            if sig in fb_by_sig:
-                c["feedback"] = fb_by_sig[sig]
 
+def _feedback_index() -> Dict[str, Dict[str, Any]]:
+    # signature -> decision, rebuilt only when feedback.jsonl changes (appends bump mtime/size)
+    try:
+        st = FEEDBACK.stat()
+    except OSError:
+        return _feedback_index_cached(0, 0)
+    return _feedback_index_cached(st.st_mtime_ns, st.st_size)
 
-    user_prompt = USER_TEMPLATE.format(
-        summary_json=json.dumps(summary, ensure_ascii=False, indent=2),
-        clusters_json=json.dumps(compact_clusters, ensure_ascii=False, indent=2),
+
+_EMPTY: Dict[str, Any] = {}
+
+# characters of each cluster message shown to the planner; enough to classify it
+MSG_BUDGET = 240
+
+
+def _clip(msg: Optional[str], budget: int) -> Optional[str]:
+    # head keeps the exception type, tail the innermost detail
+    if not msg or len(msg) <= budget:
+        return msg
+    head = budget * 2 // 3
+    return msg[:head] + "…" + msg[-(budget - head - 1):]
+
+
+def _interned(v: Any) -> Any:
+    # low-cardinality fields (label, service, ...) share one str object across clusters
+    return sys.intern(v) if isinstance(v, str) else v
+
+
+def _compact_clusters(triaged_items: List[Dict[str, Any]], msg_budget: int = MSG_BUDGET) -> List[Dict[str, Any]]:
+    return [
+        {
+            "idx": it.get("idx"),
+            "signature": it.get("signature"),
+            "service": _interned(it.get("service")),
+            "label": _interned(triage.get("label")),
+            "priority": _interned(triage.get("priority")),
+            "severity": _interned(triage.get("severity")),
+            "confidence": triage.get("confidence"),
+            "count": it.get("count"),
+            "java_class": it.get("java_class"),
+            "message": _clip(it.get("message"), msg_budget),
+        }
+        for it in triaged_items
+        for triage in (it.get("triage") or _EMPTY,)
+    ]
+
+
+def _apply_feedback(
+        compact_clusters: List[Dict[str, Any]],
+        fb_by_sig: Dict[str, Dict[str, Any]],
+) -> Tuple[List[Dict[str, Any]], List[str]]:
+    # clusters a reviewer already rejected are never ticketed again, so the planner
+    # does not see them at all; they are listed in the plan instead
+    rejected_sigs: List[str] = []
+    kept: List[Dict[str, Any]] = []
+    for c in compact_clusters:
+        fb = fb_by_sig.get(c.get("signature"))
+        if fb is not None:
+            if fb.get("decision") == "rejected":
+                rejected_sigs.append(c["signature"])
+                continue
+            c["feedback"] = fb
+        kept.append(c)
+    return kept, rejected_sigs
+
+
+def _planner_clusters(
+        triaged_items: List[Dict[str, Any]],
+        use_feedback: bool,
+        msg_budget: int,
+) -> Tuple[List[Dict[str, Any]], List[str]]:
+    compact_clusters = _compact_clusters(triaged_items, msg_budget)
+    if not use_feedback:
+        return compact_clusters, []
+    return _apply_feedback(compact_clusters, _feedback_index())
+
+
+# column order of the cluster table sent to the planner
+TABLE_KEYS = [
+    "idx", "signature", "service", "label", "priority", "severity",
+    "confidence", "count", "java_class", "message", "feedback",
+]
+
+
+def _plan_prompt(summary: Dict[str, Any], compact_clusters: List[Dict[str, Any]]) -> str:
+    # one header row of keys instead of repeating every key in every cluster
+    table = {
+        "keys": TABLE_KEYS,
+        "rows": [
+            [c.get(k) for k in TABLE_KEYS[:-1]] + [(c.get("feedback") or _EMPTY).get("decision")]
+            for c in compact_clusters
+        ],
+    }
+    return USER_TEMPLATE.format(
+        summary_json=fastjson.dumps_str(summary),
+        clusters_json=fastjson.dumps_str(table),
     )
 
-    out = ask_json(SYSTEM, user_prompt)
 
+# a remaining cluster at these severities always goes to the planner, even if reviewed
+_URGENT_SEVERITIES = frozenset({"critical", "high"})
+
+
+def _idle_plan(compact_clusters: List[Dict[str, Any]], rejected_sigs: List[str]) -> Optional[Dict[str, Any]]:
+    """
+    The all-agents-off plan when there is nothing for the LLM to decide: every remaining
+    cluster was already reviewed and none is critical/high severity (or there are none).
+    None means the LLM has to plan.
+    """
+    for c in compact_clusters:
+        if "feedback" not in c:
+            return None
+        if (c.get("severity") or "").strip().lower() in _URGENT_SEVERITIES:
+            return None
+    add_fast_path_plan()
+    plan = _plan_from_output({"reason": "fast path: no unreviewed clusters"}, rejected_sigs)
+    plan["fast_path"] = True
+    return plan
+
+
+def _plan_from_output(out: Dict[str, Any], rejected_sigs: List[str]) -> Dict[str, Any]:
     actions = out.get("actions")
     if not isinstance(actions, list) or len(actions) == 0:
-        actions = [
-            {
-                "agent": "JIRA_AGENT",
-                "run": False,
-                "cluster_indices": [],
-            },
-            {
-                "agent": "FILTER_AGENT",
-                "run": False,
-                "for_labels": ["timeout", "external_service", "noise"],
-                "min_count": None,
-            },
-            {
-                "agent": "CONFLUENCE_AGENT",
-                "run": False,
-            },
-        ]
-
-    normalized_actions = []
-    for a in actions:
-        agent = a.get("agent")
-        if agent == "JIRA_AGENT":
-            normalized_actions.append(
-                {
-                    "agent": "JIRA_AGENT",
-                    "run": bool(a.get("run", False)),
-                    "cluster_indices": a.get("cluster_indices", []),
-                }
-            )
-        elif agent == "FILTER_AGENT":
-            normalized_actions.append(
-                {
-                    "agent": "FILTER_AGENT",
-                    "run": bool(a.get("run", False)),
-                    "for_labels": a.get("for_labels", ["timeout", "external_service", "noise"]),
-                    "min_count": a.get("min_count"),
-                }
-            )
-        elif agent == "CONFLUENCE_AGENT":
-            normalized_actions.append(
-                {
-                    "agent": "CONFLUENCE_AGENT",
-                    "run": bool(a.get("run", False)),
-                }
-            )
+        # nothing usable from the LLM: every agent with its defaults (run=False)
+        actions = [{"agent": agent} for agent in AGENT_SCHEMAS]
+
+    normalized_actions = [
+        action
+        for action in (_normalize_action(a) for a in actions if isinstance(a, dict))
+        if action is not None
+    ]
 
     reason = out.get("reason", "no reason provided")
     global_policy = out.get("global_policy", {})
 
-    return {
+    plan = {
         "actions": normalized_actions,
         "global_policy": global_policy,
         "reason": reason,
     }
+    if rejected_sigs:
+        plan["skipped_rejected_signatures"] = sorted(set(rejected_sigs))
+    if out.get("_error"):
+        plan["llm_error"] = out["_error"]
+    if out.get("_partial"):
+        # parsed from a truncated reply: actions after the cut are missing
+        plan["llm_partial"] = True
+    return plan
+
+
+def plan_actions(
+        summary: Dict[str, Any],
+        triaged_items: List[Dict[str, Any]],
+        use_feedback: bool = True,
+        cache_ttl: Optional[float] = PLAN_CACHE_TTL,
+        msg_budget: int = MSG_BUDGET,
+) -> Dict[str, Any]:
+    compact_clusters, rejected_sigs = _planner_clusters(triaged_items, use_feedback, msg_budget)
+    idle = _idle_plan(compact_clusters, rejected_sigs)
+    if idle is not None:
+        return idle
+    user_prompt = _plan_prompt(summary, compact_clusters)
+
+    # the prompt embeds summary, clusters and feedback, so it is the cache fingerprint;
+    # streamed so the call returns as soon as the plan object is complete
+    out = ask_json(SYSTEM, user_prompt, max_age=cache_ttl, stream=True, schema=PLAN_SCHEMA)
+    return _plan_from_output(out, rejected_sigs)
+
+
+def plan_actions_batch(
+        windows: List[Tuple[Dict[str, Any], List[Dict[str, Any]]]],
+        use_feedback: bool = True,
+        cache_ttl: Optional[float] = PLAN_CACHE_TTL,
+        msg_budget: int = MSG_BUDGET,
+) -> List[Dict[str, Any]]:
+    """
+    Plans several (summary, triaged_items) log windows at once, e.g. for a backfill.
+    The requests share SYSTEM and the template header as a common prefix and are sent
+    concurrently; plans are returned in the order of windows.
+    """
+    plans: List[Optional[Dict[str, Any]]] = []
+    pending: List[Tuple[int, str, List[str]]] = []
+    for summary, items in windows:
+        compact_clusters, rejected_sigs = _planner_clusters(items, use_feedback, msg_budget)
+        idle = _idle_plan(compact_clusters, rejected_sigs)
+        if idle is None:
+            pending.append((len(plans), _plan_prompt(summary, compact_clusters), rejected_sigs))
+        plans.append(idle)
+
+    outs = ask_json_many(SYSTEM, [prompt for _, prompt, _ in pending], max_age=cache_ttl, schema=PLAN_SCHEMA)
+    for (i, _, rejected_sigs), out in zip(pending, outs):
+        plans[i] = _plan_from_output(out, rejected_sigs)
+    return plans
+
+
+async def aplan_actions(
+        summary: Dict[str, Any],
+        triaged_items: List[Dict[str, Any]],
+        use_feedback: bool = True,
+        cache_ttl: Optional[float] = PLAN_CACHE_TTL,
+        msg_budget: int = MSG_BUDGET,
+) -> Dict[str, Any]:
+    """
+    plan_actions for async callers: feedback.jsonl is read in a worker thread while
+    the compact clusters are built, and the LLM request does not block the event loop.
+    """
+    fb_task = asyncio.create_task(asyncio.to_thread(_feedback_index)) if use_feedback else None
+    compact_clusters = _compact_clusters(triaged_items, msg_budget)
+    rejected_sigs: List[str] = []
+    if fb_task is not None:
+        compact_clusters, rejected_sigs = _apply_feedback(compact_clusters, await fb_task)
+
+    idle = _idle_plan(compact_clusters, rejected_sigs)
+    if idle is not None:
+        return idle
+
+    async with new_async_client() as aclient:
+        out = await ask_json_async(
+            aclient, SYSTEM, _plan_prompt(summary, compact_clusters), max_age=cache_ttl, schema=PLAN_SCHEMA)
+    return _plan_from_output(out, rejected_sigs)
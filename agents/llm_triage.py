@@ -1,23 +1,44 @@
 # agents/llm_triage.py
 from __future__ import annotations
 
-import json
+import os
 from pathlib import Path
+from collections import defaultdict
 from typing import Dict, Any, List
 
-from utils.file_loader import load_refined_clusters
-from utils.llm import ask_json
+from utils import fastjson
+from utils.file_loader import load_refined_clusters, save_json, save_json_items
+from utils.llm import ask_json_many, ask_json_batch, batch_enabled, cache_key, cache_get, cache_put
 import re
 import hashlib
 
 TRIAGED_LOGS_OUTPUT = Path("output") / "triaged_logs.json"
+TRIAGED_LOGS_NDJSON = Path("output") / "triaged_logs.ndjson"
+# also write one triaged cluster per line for line-oriented consumers
+NDJSON_OUTPUT = os.getenv("ALOE_TRIAGE_NDJSON", "0") == "1"
+
+_DIGIT_RE = re.compile(r"\d+")
+
+# Verdicts are cached per signature across runs, so recurring clusters skip the LLM.
+# The key also carries the prompt digest and a power-of-two bucket of the hit count,
+# since priority depends on how often the cluster occurs.
+TRIAGE_CACHE_TTL = int(os.getenv("ALOE_TRIAGE_CACHE_TTL", str(7 * 24 * 3600)))
+
+# Clusters that are noise by construction (debug/trace level, health checks, heartbeats)
+# are labelled locally instead of being sent to the LLM. Enabled with ALOE_TRIAGE_PREFILTER=1.
+LOCAL_PREFILTER = os.getenv("ALOE_TRIAGE_PREFILTER", "0") == "1"
+_NOISE_LEVELS = {"DEBUG", "TRACE"}
+_NOISE_RE = re.compile(r"(?i)\b(health[- ]?check|heartbeat|keep[- ]?alive)\b")
 
 # None = triage all clusters
 TRIAGE_TOP_N: int | None = None
 
-# How many clusters per LLM call
+# How many clusters per LLM call (at most)
 BATCH_SIZE: int = 7
 
+# Input budget per LLM call; clusters with long logs are packed into smaller batches
+BATCH_MAX_TOKENS: int = int(os.getenv("ALOE_TRIAGE_BATCH_TOKENS", "6000"))
+
 
 SYSTEM = """You are a senior backend engineer helping with log triage in an enterprise web application.
 
@@ -70,17 +91,60 @@ Clusters:
 Triage ALL clusters and return a single JSON object with key "items", as described in the system prompt.
 """
 
+# fields of a triage verdict, in output order
+_TRIAGE_KEYS = ("label", "service", "priority", "severity", "confidence", "reason")
+
+_PROMPT_DIGEST = hashlib.blake2b((SYSTEM + USER_TEMPLATE).encode("utf-8"), digest_size=16).hexdigest()
+
 
 def make_cluster_signature(java_class: str | None, message: str | None) -> str:
     base = (java_class or "") + "|" + (message or "")
-    normalized = re.sub(r"\d+", "#", base)
+    normalized = _DIGIT_RE.sub("#", base)
     h = hashlib.sha1(normalized.encode("utf-8")).hexdigest()[:12]
     return h
 
 
-def _chunked(seq: List[Any], size: int):
-    for i in range(0, len(seq), size):
-        yield seq[i : i + size]
+def _triage_cache_key(signature: str, count: Any) -> str:
+    return cache_key("triage", _PROMPT_DIGEST, signature, int(count or 0).bit_length())
+
+
+def _quick_triage(level: str | None, java_class: str | None, message: str | None) -> Dict[str, Any] | None:
+    if (level or "").upper() in _NOISE_LEVELS:
+        reason = f"local rule: {level.upper()} level log"
+    elif _NOISE_RE.search(message or "") or _NOISE_RE.search(java_class or ""):
+        reason = "local rule: health check / heartbeat message"
+    else:
+        return None
+    return {
+        "label": "noise",
+        "priority": "low",
+        "severity": "low",
+        "confidence": 0.9,
+        "reason": reason,
+    }
+
+
+def _estimate_tokens(cluster: Dict[str, Any]) -> int:
+    # ~4 characters per token, measured on the compact JSON the prompt uses
+    return len(fastjson.dumps_str(cluster)) // 4
+
+
+def _pack_batches(
+        clusters: List[Dict[str, Any]],
+        max_tokens: int = BATCH_MAX_TOKENS,
+        max_items: int = BATCH_SIZE,
+):
+    batch: List[Dict[str, Any]] = []
+    tokens = 0
+    for c in clusters:
+        t = _estimate_tokens(c)
+        if batch and (tokens + t > max_tokens or len(batch) >= max_items):
+            yield batch
+            batch, tokens = [], 0
+        batch.append(c)
+        tokens += t
+    if batch:
+        yield batch
 
 
 def run() -> Dict[str, Any]:
@@ -90,108 +154,134 @@ def run() -> Dict[str, Any]:
         clusters = clusters[:TRIAGE_TOP_N]
 
     if not clusters:
-        TRIAGED_LOGS_OUTPUT.parent.mkdir(parents=True, exist_ok=True)
-        TRIAGED_LOGS_OUTPUT.write_text(
-            json.dumps({"items": []}, indent=2),
-            encoding="utf-8",
-        )
-        return {"count": 0, "output": str(TRIAGED_LOGS_OUTPUT)}
+        save_json(TRIAGED_LOGS_OUTPUT, {"items": []})
+        return {"count": 0, "output": str(TRIAGED_LOGS_OUTPUT), "items": []}
 
-    compact_clusters: List[Dict[str, Any]] = []
+    # clusters whose (java_class, message) only differ by numeric ids share one LLM verdict
+    by_sig: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    # output items, built in the same pass; "triage" is filled in after the LLM calls
+    results: List[Dict[str, Any]] = []
+    levels: Dict[int, Any] = {}
     for i, c in enumerate(clusters):
         idx = c.get("idx")
-        if idx is None:
-            idx = i
+        idx = i if idx is None else int(idx)
 
-        sample_source = c.get("sample") or {}
-        service = sample_source.get("service")
-        full_log = sample_source.get("raw").get("log") or c.get("message") or ""
+        sample = c.get("sample") or {}
+        sample_source = sample.get("raw") or sample
+        service = sample.get("service")
+        levels[idx] = sample.get("level")
+        java_class = c.get("java_class")
+        message = c.get("message")
+        full_log = sample_source.get("log", "") or ""
 
-        compact_clusters.append(
+        sig = make_cluster_signature(java_class, message)
+        by_sig[sig].append(
             {
                 "idx": idx,
                 "service": service,
-                "java_class": c.get("java_class"),
-                "message": c.get("message"),
-                "log": full_log,
+                "java_class": java_class,
+                "message": message,
+                "log": full_log or message or "",
                 "count": c.get("count"),
             }
         )
-
-    triage_by_idx: Dict[int, Dict[str, Any]] = {}
-
-    for batch in _chunked(compact_clusters, BATCH_SIZE):
-        user = USER_TEMPLATE.format(
-            clusters_json=json.dumps(batch, ensure_ascii=False, indent=2)
+        results.append(
+            {
+                "idx": idx,
+                "signature": sig,
+                "service": service,
+                "java_class": java_class,
+                "message": message,
+                "count": c.get("count"),
+                "stack_excerpt": "\n".join(full_log.splitlines()[:15]),
+            }
         )
 
-        out = ask_json(SYSTEM, user)
+    reps = {sig: max(members, key=lambda m: m.get("count") or 0) for sig, members in by_sig.items()}
+    triage_by_idx: Dict[int, Dict[str, Any]] = {}
 
+    compact_clusters: List[Dict[str, Any]] = []
+    key_by_idx: Dict[int, str] = {}
+    for sig, rep in reps.items():
+        quick = _quick_triage(levels[rep["idx"]], rep["java_class"], rep["message"]) if LOCAL_PREFILTER else None
+        if quick is not None:
+            triage_by_idx[rep["idx"]] = quick
+            continue
+        key = _triage_cache_key(sig, rep["count"])
+        cached = cache_get(key, max_age=TRIAGE_CACHE_TTL)
+        if isinstance(cached, dict) and cached:
+            triage_by_idx[rep["idx"]] = cached
+        else:
+            compact_clusters.append(rep)
+            key_by_idx[rep["idx"]] = key
+
+    user_prompts = [
+        # compact JSON: indentation only adds billed whitespace tokens
+        USER_TEMPLATE.format(clusters_json=fastjson.dumps_str(batch))
+        for batch in _pack_batches(compact_clusters)
+    ]
+
+    # batches are independent, so they are sent concurrently (or as one Batch API job for
+    # offline runs); results come back in order. Whole batches are not cached: verdicts
+    # are cached per signature above, so TRIAGE_CACHE_TTL is the only expiry.
+    ask = ask_json_batch if batch_enabled() else ask_json_many
+    uncacheable = set()
+    for out in ask(SYSTEM, user_prompts, cache=False):
         if not isinstance(out, dict):
             continue
 
+        # a truncated reply may end in a cut-off verdict; use it for this run only
+        partial = bool(out.get("_partial"))
         triaged_items = out.get("items") or []
         for item in triaged_items:
             if not isinstance(item, dict):
                 continue
-            idx = item.get("idx")
-            if idx is None:
+            try:
+                idx = int(item.get("idx"))
+            except (TypeError, ValueError):
                 continue
 
             triage = item.get("triage")
-            if not isinstance(triage, dict) or not triage:
-                triage = {
-                    "label": item.get("label"),
-                    "service": item.get("service"),
-                    "priority": item.get("priority"),
-                    "severity": item.get("severity"),
-                    "confidence": item.get("confidence"),
-                    "reason": item.get("reason"),
-                }
-
-            triage_by_idx[int(idx)] = triage
-
-    results: List[Dict[str, Any]] = []
-
-    for i, c in enumerate(clusters):
-        idx = c.get("idx")
-        if idx is None:
-            idx = i
-
-        triage = triage_by_idx.get(int(idx), {}) or {}
-
-        sample = c.get("sample") or {}
-        sample_source = sample.get("raw") or sample
-        service = sample.get("service")
-
-        full_log = sample_source.get("log", "") or ""
-        stack_lines = full_log.splitlines()
-        stack_excerpt = "\n".join(stack_lines[:15])
-
-        java_class = c.get("java_class")
-        message = c.get("message")
-        signature = make_cluster_signature(java_class, message)
-
-        if "service" not in triage or triage.get("service") is None:
-            triage["service"] = service
-
-        results.append(
-            {
-                "idx": idx,
-                "signature": signature,
-                "service": service,
-                "java_class": java_class,
-                "message": message,
-                "count": c.get("count"),
-                "stack_excerpt": stack_excerpt,
-                "triage": triage,
-            }
-        )
-
-    TRIAGED_LOGS_OUTPUT.parent.mkdir(parents=True, exist_ok=True)
-    TRIAGED_LOGS_OUTPUT.write_text(
-        json.dumps({"items": results}, indent=2, ensure_ascii=False),
-        encoding="utf-8",
+            if not (isinstance(triage, dict) and triage):
+                # flat item: the triage fields sit next to idx
+                triage = {k: item.get(k) for k in _TRIAGE_KEYS}
+
+            triage_by_idx[idx] = triage
+            if partial:
+                uncacheable.add(idx)
+
+    for idx, key in key_by_idx.items():
+        triage = triage_by_idx.get(idx)
+        if idx not in uncacheable and isinstance(triage, dict) and triage.get("label"):
+            # service is filled in from the current cluster when the items are written
+            cache_put(key, {k: v for k, v in triage.items() if k != "service"})
+
+    for sig, members in by_sig.items():
+        if len(members) < 2:
+            continue
+        triage = triage_by_idx.get(reps[sig]["idx"])
+        if triage is None:
+            continue
+        # copies without the representative's service, which the results loop below
+        # fills in from each member's own cluster
+        shared = {k: v for k, v in triage.items() if k != "service"}
+        for m in members:
+            triage_by_idx.setdefault(m["idx"], dict(shared))
+
+    def _results():
+        for item in results:
+            triage = triage_by_idx.get(item["idx"]) or {}
+            if "service" not in triage or triage.get("service") is None:
+                triage["service"] = item["service"]
+            item["triage"] = triage
+            yield item
+
+    # items are streamed to disk as their triage is attached rather than dumped at once
+    count = save_json_items(
+        TRIAGED_LOGS_OUTPUT,
+        _results(),
+        ndjson=TRIAGED_LOGS_NDJSON if NDJSON_OUTPUT else None,
     )
 
-    return {"count": len(results), "output": str(TRIAGED_LOGS_OUTPUT)}
+    # in-process callers (run_all) take the items from here instead of re-reading the file
+    return {"count": count, "output": str(TRIAGED_LOGS_OUTPUT), "items": results}
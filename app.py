@@ -9,6 +9,8 @@ from agents.llm_filter import run as filter_run
 from agents.llm_confluence import run as conf_run
 from tools.executor import run_full_pipeline
 from tools.feedback_review import run as feedback_review_run
+from utils.llm import set_llm_batch
+from utils.file_loader import migrate_legacy_feedback
 
 def main():
     parser = argparse.ArgumentParser(description="ALOE - Adaptive Log Orchestration Engine")
@@ -45,7 +47,27 @@ def main():
         help="Whether the orchestrator should use historical feedback.",
     )
 
+    parser.add_argument(
+        "--cache",
+        choices=["on", "off"],
+        default="on",
+        help="Reuse cached summary/orchestrator plan when the triaged clusters are unchanged, "
+             "LLM responses for unchanged prompts (output/.llm_cache), and in mock Jira mode the "
+             "whole previous run result when its inputs and outputs are untouched. 'off' disables all three.",
+    )
+
+    parser.add_argument(
+        "--batch",
+        choices=["on", "off"],
+        default=None,
+        help="Send triage, Jira draft and filter requests through the provider Batch API (cheaper, completes asynchronously). Defaults to ALOE_LLM_BATCH.",
+    )
+
     args = parser.parse_args()
+    migrate_legacy_feedback()
+    use_batch = None if args.batch is None else (args.batch == "on")
+    if use_batch is not None:
+        set_llm_batch(use_batch)
 
     if args.command == "preprocess":
         print("[bold green]Log Preprocessor Agent...[/bold green]")
@@ -61,7 +83,7 @@ def main():
         print("[bold green]Jira Ticketing LLM Agent (drafts)...[/bold green]")
         res = jira_draft_run(jira_mode=args.jira_mode,
                              mode=args.mode,)
-        print(f"[bold cyan]Drafted {res['count']} tickets → output/jira_drafts.json[/bold cyan]")
+        print(f"[bold cyan]Drafted {res['count']} tickets → {res['output']}[/bold cyan]")
 
     elif args.command == "filter_suggestions":
         print("[bold green]Filter Generalization LLM Agent...[/bold green]")
@@ -77,7 +99,7 @@ def main():
         print("[bold green]Interactive Jira feedback review...[/bold green]")
         res = feedback_review_run()
         print(f"[bold cyan]Approved {res['approved']} drafts, rejected {res['rejected']}, skipped all: {res['skipped_all']}, "
-          f"wrote feedback entries → output/feedback.json[/bold cyan]")
+          f"wrote feedback entries → output/feedback.jsonl[/bold cyan]")
 
     elif args.command == "run_all":
         use_feedback = (args.feedback == "on")
@@ -85,7 +107,9 @@ def main():
         res = run_full_pipeline(source=args.source,
                                 jira_mode=args.jira_mode,
                                 mode=args.mode,
-                                use_feedback=use_feedback,)
+                                use_feedback=use_feedback,
+                                use_cache=(args.cache == "on"),
+                                use_batch=use_batch,)
         print("[bold magenta]Pipeline finished.[/bold magenta]")
         print(res)
 
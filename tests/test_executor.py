@@ -0,0 +1,77 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+os.environ.setdefault("GROQ_API_KEY", "test")
+
+from utils import fastjson
+from utils.file_loader import TRIAGED, JIRA_DRAFTS_NDJSON, clear_caches
+from utils.llm import set_llm_cache
+from tools import executor
+import agents.llm_jira as llm_jira
+
+
+def _fake_drafts(system, prompts, **kwargs):
+    outs = []
+    for prompt in prompts:
+        idxs = [c["idx"] for c in fastjson.loads(prompt[prompt.index("["): prompt.rindex("]") + 1])]
+        outs.append({"items": [{"idx": i, "summary": f"S{i}", "service_name": "svc"} for i in idxs]})
+    return outs
+
+
+class PlanFallbackTest(unittest.TestCase):
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._tmp = tempfile.TemporaryDirectory()
+        os.chdir(self._tmp.name)
+        set_llm_cache(False)
+        clear_caches()
+        items = [
+            {
+                "idx": i,
+                "signature": f"sig{i}",
+                "service": "svc",
+                "java_class": "a.B",
+                "message": f"boom {i}",
+                "count": 5,
+                "triage": {"label": "internal_error", "priority": "high", "severity": "high"},
+            }
+            for i in range(3)
+        ]
+        TRIAGED.parent.mkdir(parents=True, exist_ok=True)
+        TRIAGED.write_bytes(fastjson.dumps({"items": items}))
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        self._tmp.cleanup()
+        set_llm_cache(True)
+        clear_caches()
+
+    def test_llm_error_plan_still_produces_baseline_drafts(self):
+        summary = {"internal_high_count": 3, "triaged_cluster_count": 3, "by_label": {"internal_error": 3}}
+
+        def failing_planner(summary, triaged_items, use_feedback=True):
+            return {"actions": [], "llm_error": "boom"}
+
+        plan = asyncio.run(executor._plan_with_fallback(failing_planner, summary, [], use_feedback=False))
+        self.assertEqual(plan.get("fallback"), "baseline")
+
+        dispatch = dict(executor.AGENT_DISPATCH)
+        dispatch["FILTER_AGENT"] = ("filter_suggestions", lambda: {"count": 0}, (), (), "filter")
+        dispatch["CONFLUENCE_AGENT"] = ("confluence_draft", lambda: {}, (), (), "confluence")
+        with mock.patch.dict(executor.AGENT_DISPATCH, dispatch), \
+                mock.patch.dict(executor.AGENT_ENRICHERS, {}, clear=True), \
+                mock.patch.object(llm_jira, "ask_json_many", _fake_drafts), \
+                mock.patch.object(llm_jira, "create_jira_issues", lambda drafts: []):
+            results = executor.execute_actions(plan, mode="orchestrator", use_feedback=False)
+
+        self.assertEqual(results["errors"], [])
+        self.assertEqual(results["jira_drafts"]["count"], 3)
+        lines = JIRA_DRAFTS_NDJSON.read_bytes().splitlines()
+        self.assertEqual(sorted(fastjson.loads(l)["idx"] for l in lines), [0, 1, 2])
+
+
+if __name__ == "__main__":
+    unittest.main()
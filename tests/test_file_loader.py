@@ -0,0 +1,31 @@
+import os
+import tempfile
+import unittest
+
+from utils import fastjson
+from utils.file_loader import FEEDBACK, LEGACY_FEEDBACK, load_feedback, migrate_legacy_feedback
+
+
+class FeedbackLoaderTest(unittest.TestCase):
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._tmp = tempfile.TemporaryDirectory()
+        os.chdir(self._tmp.name)
+        LEGACY_FEEDBACK.parent.mkdir(parents=True, exist_ok=True)
+        LEGACY_FEEDBACK.write_bytes(fastjson.dumps([{"signature": "s1", "decision": "approved"}]))
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        self._tmp.cleanup()
+
+    def test_load_feedback_does_not_migrate_legacy_file(self):
+        self.assertEqual(load_feedback(), [])
+        self.assertFalse(FEEDBACK.exists())
+
+    def test_explicit_migration_makes_legacy_entries_readable(self):
+        self.assertEqual(migrate_legacy_feedback(), 1)
+        self.assertEqual([e["signature"] for e in load_feedback()], ["s1"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+import os
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from types import SimpleNamespace as NS
+from unittest import mock
+
+os.environ.setdefault("GROQ_API_KEY", "test")
+
+from utils import llm
+from utils.metrics import LLM_USAGE, reset_llm_usage
+
+
+def _stream(text, usage, step=5):
+    chunks = [NS(choices=[NS(delta=NS(content=text[i:i + step]))]) for i in range(0, len(text), step)]
+    chunks.append(NS(choices=[], x_groq=NS(usage=usage)))
+    return iter(chunks)
+
+
+class ReadJsonStreamTest(unittest.TestCase):
+    def setUp(self):
+        reset_llm_usage()
+
+    def test_usage_in_final_chunk_is_recorded_after_object_closes(self):
+        text = '{"a": "x\\"}", "b": {"c": 1}}\n\nThis plan {was} chosen because...'
+        usage = NS(prompt_tokens=1000, completion_tokens=50)
+
+        out = llm._read_json_stream(_stream(text, usage))
+
+        self.assertEqual(out, '{"a": "x\\"}", "b": {"c": 1}}')
+        self.assertEqual(LLM_USAGE.prompt_tokens, 1000)
+        self.assertEqual(LLM_USAGE.completion_tokens, 50)
+        self.assertEqual(LLM_USAGE.calls, 1)
+
+
+class LlmCachePruneTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        patcher = mock.patch.object(llm, "LLM_CACHE_DIR", Path(self._tmp.name))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self._tmp.cleanup)
+        llm.reset_llm_cache()
+
+    def _entry(self, name, age, size=10):
+        path = llm.LLM_CACHE_DIR / f"{name}.json"
+        path.write_bytes(b"0" * size)
+        stamp = time.time() - age
+        os.utime(path, (stamp, stamp))
+        return path
+
+    def test_expired_entries_are_removed(self):
+        old = self._entry("old", age=100)
+        fresh = self._entry("fresh", age=1)
+
+        self.assertEqual(llm.prune_llm_cache(max_age=50, max_bytes=1 << 20), 1)
+        self.assertFalse(old.exists())
+        self.assertTrue(fresh.exists())
+
+    def test_oldest_entries_go_first_when_over_size(self):
+        paths = [self._entry(f"e{i}", age=10 - i) for i in range(5)]
+
+        llm.prune_llm_cache(max_age=3600, max_bytes=25)
+
+        self.assertEqual([p.exists() for p in paths], [False, False, False, True, True])
+
+    def test_default_ttl_applies_without_max_age(self):
+        key = llm.cache_key("prompt")
+        llm.cache_put(key, {"a": 1})
+        llm.reset_llm_cache()
+        path = llm.LLM_CACHE_DIR / f"{key}.json"
+        stamp = time.time() - llm.LLM_CACHE_TTL - 10
+        os.utime(path, (stamp, stamp))
+
+        self.assertIsNone(llm.cache_get(key))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,38 +2,68 @@
 
 import time
 import json
+import asyncio
 import hashlib
+import importlib
 from pathlib import Path
-from typing import Dict, Any, List, Optional
-from datetime import datetime
-from rich import print
-
-from utils.file_loader import load_triaged, load_feedback
+from typing import Dict, Any, List, Optional, Callable
+from datetime import datetime, timezone
+
+from utils import fastjson
+from utils.file_loader import (
+    load_triaged, load_jira_drafts, load_filter, load_feedback, save_json,
+    TRIAGED, JIRA_DRAFTS_NDJSON, JIRA_DRAFTS_SUMMARY, FILTERS, CLUSTERS_REFINED_OUTPUT,
+)
 from utils.metrics import LLM_USAGE, reset_llm_usage
+from utils.llm import set_llm_cache, set_llm_batch
 
 from tools.log_preprocessor import run as preprocess_run
 from agents.llm_triage import run as triage_run
-from tools.summary import build_summary
+from tools.summary import build_summary, write_summary, SUMMARY_PATH
 from agents.llm_jira import run as jira_draft_run
 from agents.llm_filter import run as filter_run
 from agents.llm_confluence import run as conf_run
-from agents.llm_orchestrator import plan_actions
 from agents.llm_cluster_refiner import run as cluster_refine_run
+from agents.llm_orchestrator import PLAN_CACHE_TTL
 
 
-JIRA_DRAFTS_PATH = Path("output") / "jira_drafts.json"
-FILTER_SUGGESTIONS_PATH = Path("output") / "filter_suggestions.json"
 JIRA_REVIEW_PATH = Path("output") / "jira_review.json"
+PIPELINE_CACHE_DIR = Path("output") / ".plan_cache"
+
+# Files written after preprocessing. A cached run result is only replayed while these are
+# exactly the files that run left behind, so output/ always matches the returned result.
+RUN_ARTIFACTS = (
+    CLUSTERS_REFINED_OUTPUT,
+    TRIAGED,
+    SUMMARY_PATH,
+    JIRA_DRAFTS_NDJSON,
+    JIRA_DRAFTS_SUMMARY,
+    FILTERS,
+    Path("output") / "confluence_draft.md",
+    JIRA_REVIEW_PATH,
+)
+
+_rich_print = None
+
+
+def _print(*args: Any, **kwargs: Any) -> None:
+    # rich is imported on first use so importing the executor (e.g. for
+    # build_baseline_plan) does not pay for console/theme initialization
+    global _rich_print
+    if _rich_print is None:
+        from rich import print as _rich_print
+    _rich_print(*args, **kwargs)
+
 
 def _now_iso() -> str:
-    return datetime.utcnow().isoformat() + "Z"
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
 
 
 def _safe_load_json(path: Path, default: Any) -> Any:
     try:
         if not path.exists():
             return default
-        return json.loads(path.read_text(encoding="utf-8"))
+        return fastjson.loads(path.read_bytes())
     except Exception:
         return default
 
@@ -43,9 +73,40 @@ def _hash_config(obj: Dict[str, Any]) -> str:
     return hashlib.sha1(raw).hexdigest()[:12]
 
 
+def _content_hash(obj: Any) -> str:
+    raw = fastjson.dumps(obj, sort_keys=True, default=str)
+    return hashlib.blake2b(raw, digest_size=16).hexdigest()
+
+
+def _cache_load(kind: str, key: str, max_age: Optional[float] = None) -> Any:
+    path = PIPELINE_CACHE_DIR / f"{kind}-{key}.json"
+    if max_age is not None:
+        try:
+            if time.time() - path.stat().st_mtime > max_age:
+                return None
+        except OSError:
+            return None
+    return _safe_load_json(path, None)
+
+
+def _cache_store(kind: str, key: str, value: Any) -> None:
+    save_json(PIPELINE_CACHE_DIR / f"{kind}-{key}.json", value)
+
+
+def _artifact_stamps() -> List[Any]:
+    stamps: List[Any] = []
+    for path in RUN_ARTIFACTS:
+        try:
+            st = path.stat()
+            stamps.append([str(path), st.st_mtime_ns, st.st_size])
+        except OSError:
+            stamps.append([str(path), None, None])
+    return stamps
+
+
 def _normalize_json(obj: Any) -> Optional[str]:
     try:
-        return json.dumps(obj, sort_keys=True, ensure_ascii=False)
+        return fastjson.dumps_str(obj, sort_keys=True)
     except Exception:
         return None
 
@@ -54,32 +115,26 @@ def _enrich_jira_drafts_result(
         base: Dict[str, Any],
         use_feedback: bool,
 ) -> Dict[str, Any]:
-    data = _safe_load_json(JIRA_DRAFTS_PATH, {})
-    drafts = data.get("drafts") or []
+    drafts = load_jira_drafts() or []
     if not isinstance(drafts, list):
         drafts = []
 
-    sigs: List[str] = []
-    for d in drafts:
-        if isinstance(d, dict) and d.get("signature"):
-            sigs.append(d["signature"])
-
-    unique_sigs = sorted(set(sigs))
-    base["signatures"] = unique_sigs
+    unique_sigs = {d["signature"] for d in drafts if isinstance(d, dict) and d.get("signature")}
+    base["signatures"] = sorted(unique_sigs)
     base["unique_signature_count"] = len(unique_sigs)
 
     if use_feedback:
         fb = load_feedback()
         seen = {e.get("signature") for e in fb if isinstance(e, dict) and e.get("signature")}
-        base["count_seen_before"] = len([s for s in unique_sigs if s in seen])
-        base["count_new"] = len([s for s in unique_sigs if s not in seen])
+        seen_count = len(unique_sigs & seen)
+        base["count_seen_before"] = seen_count
+        base["count_new"] = len(unique_sigs) - seen_count
 
     return base
 
 
 def _enrich_filter_result(base: Dict[str, Any]) -> Dict[str, Any]:
-    data = _safe_load_json(FILTER_SUGGESTIONS_PATH, {})
-    suggestions = data.get("suggestions") or []
+    suggestions = load_filter() or []
     if not isinstance(suggestions, list):
         suggestions = []
 
@@ -98,6 +153,19 @@ def _enrich_filter_result(base: Dict[str, Any]) -> Dict[str, Any]:
     return base
 
 
+# planner per execution mode, resolved lazily so baseline runs never import
+# the LLM orchestrator module
+_PLANNERS = {
+    "orchestrator": ("agents.llm_orchestrator", "plan_actions"),
+    "pipeline": (__name__, "build_baseline_plan"),
+}
+
+
+def _get_planner(mode: str) -> Callable[..., Dict[str, Any]]:
+    mod_name, fn_name = _PLANNERS.get(mode, _PLANNERS["pipeline"])
+    return getattr(importlib.import_module(mod_name), fn_name)
+
+
 def build_baseline_plan(summary: Dict[str, Any]) -> Dict[str, Any]:
     actions = []
 
@@ -149,7 +217,57 @@ def build_baseline_plan(summary: Dict[str, Any]) -> Dict[str, Any]:
     return plan
 
 
-def execute_actions(
+async def _plan_with_fallback(
+    planner: Callable[..., Dict[str, Any]],
+    summary: Dict[str, Any],
+    triaged_items: List[Dict[str, Any]],
+    use_feedback: bool,
+) -> Dict[str, Any]:
+    # The baseline plan is CPU-only, so it is built speculatively next to the LLM call
+    # and is ready the moment the orchestrator fails or returns an unusable plan.
+    llm_plan, baseline = await asyncio.gather(
+        asyncio.to_thread(planner, summary, triaged_items, use_feedback=use_feedback),
+        asyncio.to_thread(build_baseline_plan, summary),
+        return_exceptions=True,
+    )
+    if isinstance(llm_plan, dict) and llm_plan.get("actions") and not llm_plan.get("llm_error"):
+        return llm_plan
+    if isinstance(baseline, BaseException):
+        raise baseline
+
+    reason = llm_plan.get("llm_error") if isinstance(llm_plan, dict) else llm_plan
+    _print(f"[yellow]Orchestrator plan unusable ({reason or 'no actions'}), using baseline plan[/yellow]")
+    baseline["llm_error"] = str(reason or "no_actions")
+    baseline["fallback"] = "baseline"
+    return baseline
+
+
+# Agents that read the output files written by other agents in the same run.
+# FILTER_AGENT works on the Jira drafts, CONFLUENCE_AGENT summarizes drafts and filters.
+AGENT_DEPENDENCIES: Dict[str, tuple] = {
+    "JIRA_AGENT": (),
+    "FILTER_AGENT": ("JIRA_AGENT",),
+    "CONFLUENCE_AGENT": ("JIRA_AGENT", "FILTER_AGENT"),
+}
+
+
+# agent -> (result key, runner, plan params forwarded to the runner, pipeline params forwarded, title)
+AGENT_DISPATCH: Dict[str, tuple] = {
+    "JIRA_AGENT": ("jira_drafts", jira_draft_run, ("cluster_indices",), ("mode",),
+                   "Jira Ticketing LLM Agent (drafts)"),
+    "FILTER_AGENT": ("filter_suggestions", filter_run, (), (),
+                     "Filter Generalization LLM Agent"),
+    "CONFLUENCE_AGENT": ("confluence_draft", conf_run, (), (),
+                         "Confluence Update LLM Agent (markdown draft)"),
+}
+
+AGENT_ENRICHERS: Dict[str, Callable[[Dict[str, Any], bool], Dict[str, Any]]] = {
+    "JIRA_AGENT": lambda res, use_feedback: _enrich_jira_drafts_result(res, use_feedback=use_feedback),
+    "FILTER_AGENT": lambda res, use_feedback: _enrich_filter_result(res),
+}
+
+
+async def execute_actions_async(
         plan: Dict[str, Any],
         jira_mode: str = "mock",
         mode: str = "orchestrator",
@@ -159,45 +277,71 @@ def execute_actions(
     results: Dict[str, Any] = {}
     errors: List[Dict[str, Any]] = []
 
+    runnable: List[Dict[str, Any]] = []
+    finished: Dict[str, asyncio.Event] = {}
+    # The baseline plan used as an orchestrator fallback selects no cluster indices
+    # (JIRA_AGENT gets None), so its agents run the way the baseline pipeline runs them.
+    if plan.get("fallback") == "baseline":
+        mode = "pipeline"
+    run_kwargs = {"mode": mode, "jira_mode": jira_mode}
+
     for act in actions:
         agent = act.get("agent")
         run_flag = bool(act.get("run", False))
 
         if not run_flag:
-            print(f"[yellow]Skipping {agent} as per plan[/yellow]")
+            _print(f"[yellow]Skipping {agent} as per plan[/yellow]")
             continue
 
+        runnable.append(act)
+        finished[agent] = asyncio.Event()
+
+    async def _run_action(act: Dict[str, Any]) -> Optional[tuple]:
+        agent = act.get("agent")
         try:
-            if agent == "JIRA_AGENT":
-                print("[bold green]Running Jira Ticketing LLM Agent (drafts)...[/bold green]")
-                cluster_indices = act.get("cluster_indices")
-
-                res = jira_draft_run(
-                    cluster_indices=cluster_indices,
-                    mode=mode
-                )
-                res = _enrich_jira_drafts_result(res, use_feedback=use_feedback)
-                results["jira_drafts"] = res
-
-            elif agent == "FILTER_AGENT":
-                print("[bold green]Running Filter Generalization LLM Agent...[/bold green]")
-                res = filter_run()
-                res = _enrich_filter_result(res)
-                results["filter_suggestions"] = res
-
-            elif agent == "CONFLUENCE_AGENT":
-                print("[bold green]Running Confluence Update LLM Agent (markdown draft)...[/bold green]")
-                res = conf_run()
-                results["confluence_draft"] = res
-
-            else:
-                print(f"[red]Unknown agent in plan: {agent}[/red]")
+            # Only wait for upstream agents that are actually part of this plan.
+            for dep in AGENT_DEPENDENCIES.get(agent, ()):
+                if dep in finished and dep != agent:
+                    await finished[dep].wait()
+
+            entry = AGENT_DISPATCH.get(agent)
+            if entry is None:
+                _print(f"[red]Unknown agent in plan: {agent}[/red]")
                 errors.append({"agent": agent, "error": "unknown_agent"})
+                return None
+
+            result_key, runner, plan_params, run_params, title = entry
+            _print(f"[bold green]Running {title}...[/bold green]")
+
+            kwargs = {p: act.get(p) for p in plan_params if p in act}
+            kwargs.update({p: run_kwargs[p] for p in run_params})
+            res = await asyncio.to_thread(runner, **kwargs)
+
+            # the agent's output file is written; downstream agents may start while we enrich
+            finished[agent].set()
+
+            enrich = AGENT_ENRICHERS.get(agent)
+            if enrich is not None:
+                res = await asyncio.to_thread(enrich, res, use_feedback)
+            return result_key, res
 
         except Exception as e:
-            print(f"[red]{agent} failed: {e}[/red]")
+            _print(f"[red]{agent} failed: {e}[/red]")
             errors.append({"agent": agent, "error": str(e)})
 
+        finally:
+            finished[agent].set()
+
+        return None
+
+    outcomes = await asyncio.gather(*(_run_action(act) for act in runnable))
+
+    # keep result keys in plan order regardless of completion order
+    for outcome in outcomes:
+        if outcome is not None:
+            key, res = outcome
+            results[key] = res
+
     jira_review = _safe_load_json(JIRA_REVIEW_PATH, None)
     if isinstance(jira_review, dict):
         results["jira_review"] = jira_review
@@ -206,21 +350,41 @@ def execute_actions(
     return results
 
 
+def execute_actions(
+        plan: Dict[str, Any],
+        jira_mode: str = "mock",
+        mode: str = "orchestrator",
+        use_feedback: bool = True,
+) -> Dict[str, Any]:
+    # nothing to run: skip the event loop, per-action skip messages and the review lookup
+    if not any(a.get("run") for a in plan.get("actions", [])):
+        _print("[yellow]Plan has no runnable actions, nothing to execute[/yellow]")
+        return {"errors": []}
+    return asyncio.run(
+        execute_actions_async(plan, jira_mode=jira_mode, mode=mode, use_feedback=use_feedback)
+    )
+
+
 def run_full_pipeline(
         source: str = "mock",
         jira_mode: str = "mock",
         mode: str = "orchestrator",
         use_feedback: bool = True,
         dataset_id: Optional[str] = None,
+        use_cache: bool = True,
+        use_batch: Optional[bool] = None,
 ) -> Dict[str, Any]:
     reset_llm_usage()
+    set_llm_cache(use_cache)
+    if use_batch is not None:
+        set_llm_batch(use_batch)
     start_ts = time.time()
     start_iso = _now_iso()
 
     # record time window even if query hardcodes it
     time_window = {"gte": "now-1d", "lte": "now"}
 
-    dataset_id = dataset_id or f"{source}-{datetime.utcnow().date().isoformat()}"
+    dataset_id = dataset_id or f"{source}-{datetime.now(timezone.utc).date().isoformat()}"
     run_config = {
         "mode": mode,
         "use_feedback": use_feedback,
@@ -233,14 +397,43 @@ def run_full_pipeline(
 
     context: Dict[str, Any] = {}
 
-    print("[bold green]Step 1: Log Preprocessor Agent[/bold green]")
+    _print("[bold green]Step 1: Log Preprocessor Agent[/bold green]")
     context = preprocess_run(context, source=source)
 
     log_count = len(context.get("raw_logs", []))
-    print(f"[cyan]Preprocessed {log_count} logs[/cyan]")
+    _print(f"[cyan]Preprocessed {log_count} logs[/cyan]")
+
+    # Same config, same clusters and same feedback as a previous run whose outputs are
+    # still untouched: replay that run's result. Real Jira mode always runs, since
+    # replaying would skip the issue creation.
+    run_key = None
+    if use_cache and jira_mode == "mock" and log_count:
+        run_key = _content_hash([
+            config_hash,
+            context.get("clusters"),
+            load_feedback() if use_feedback else [],
+        ])
+        # a replayed orchestrator run carries its plan, so it ages out with the plan
+        cached_run = _cache_load("run", run_key, max_age=PLAN_CACHE_TTL if mode == "orchestrator" else None)
+        if (
+            isinstance(cached_run, dict)
+            and cached_run.get("artifacts") == _artifact_stamps()
+            and isinstance(cached_run.get("result"), dict)
+        ):
+            _print("[cyan]Unchanged input and outputs, reusing the previous run result[/cyan]")
+            result = cached_run["result"]
+            end_ts = time.time()
+            result["meta"].update({
+                "start_time": start_iso,
+                "end_time": _now_iso(),
+                "duration_seconds": end_ts - start_ts,
+                "llm_usage": LLM_USAGE.to_dict(),
+                "from_cache": True,
+            })
+            return result
 
     if log_count == 0:
-        print("[yellow]No logs found. Stopping pipeline early.[/yellow]")
+        _print("[yellow]No logs found. Stopping pipeline early.[/yellow]")
         end_ts = time.time()
         end_iso = _now_iso()
         return {
@@ -250,7 +443,7 @@ def run_full_pipeline(
                 "dataset_id": dataset_id,
                 "time_window": time_window,
                 "config_hash": config_hash,
-                "date": datetime.utcnow().date().isoformat(),
+                "date": datetime.now(timezone.utc).date().isoformat(),
                 "start_time": start_iso,
                 "end_time": end_iso,
                 "duration_seconds": end_ts - start_ts,
@@ -261,29 +454,57 @@ def run_full_pipeline(
             "results": {"errors": [{"agent": "Pipeline", "error": "no_logs"}]},
         }
 
-    print("[bold green]Step 1b: LLM Cluster Refinement Agent[/bold green]")
+    _print("[bold green]Step 1b: LLM Cluster Refinement Agent[/bold green]")
     refine_res = cluster_refine_run()
-    print(f"[cyan]Refined clusters count: {refine_res.get('count')}[/cyan]")
-
-    print("[bold green]Step 2: LLM Triage Agent[/bold green]")
-    triage_run()
-    triaged_items = load_triaged()
-    print(f"[cyan]Triaged {len(triaged_items)} clusters[/cyan]")
-
-    print("[bold green]Step 3: Build summary [/bold green]")
-    summary = build_summary()
-    print(f"[cyan]Summary: {summary}[/cyan]")
+    _print(f"[cyan]Refined clusters count: {refine_res.get('count')}[/cyan]")
+
+    _print("[bold green]Step 2: LLM Triage Agent[/bold green]")
+    triage_res = triage_run()
+    # the items triage just wrote, without a decode round-trip through triaged_logs.json
+    triaged_items = triage_res.get("items")
+    if triaged_items is None:
+        triaged_items = load_triaged()
+    _print(f"[cyan]Triaged {len(triaged_items)} clusters[/cyan]")
+
+    # Unchanged triage output (replays, retries, iterative dev) reuses the summary and plan.
+    triage_key = _content_hash(triaged_items)
+
+    _print("[bold green]Step 3: Build summary [/bold green]")
+    summary_key = _content_hash([triage_key, log_count])
+    summary = _cache_load("summary", summary_key) if use_cache else None
+    if isinstance(summary, dict):
+        write_summary(summary)
+        _print("[cyan]Summary loaded from cache[/cyan]")
+    else:
+        summary = build_summary(triaged_items, log_count=log_count)
+        if use_cache:
+            _cache_store("summary", summary_key, summary)
+    _print(f"[cyan]Summary: {summary}[/cyan]")
 
+    planner = _get_planner(mode)
     if mode == "orchestrator":
-        print("[bold green]Step 4: LLM Orchestrator Agent[/bold green]")
-        plan = plan_actions(summary, triaged_items, use_feedback=use_feedback)
-        print(f"[cyan]Orchestrator plan: {plan}[/cyan]")
+        _print("[bold green]Step 4: LLM Orchestrator Agent[/bold green]")
+        plan_key = _content_hash([
+            triage_key,
+            summary,
+            use_feedback,
+            load_feedback() if use_feedback else [],
+        ])
+        # same lifetime as the LLM response the plan was built from
+        plan = _cache_load("plan", plan_key, max_age=PLAN_CACHE_TTL) if use_cache else None
+        if isinstance(plan, dict):
+            _print("[cyan]Orchestrator plan loaded from cache[/cyan]")
+        else:
+            plan = asyncio.run(_plan_with_fallback(planner, summary, triaged_items, use_feedback))
+            if use_cache and not plan.get("llm_error") and not plan.get("llm_partial"):
+                _cache_store("plan", plan_key, plan)
+        _print(f"[cyan]Orchestrator plan: {plan}[/cyan]")
     else:
-        print("[bold green]Step 4: Baseline pipeline plan (no orchestrator)[/bold green]")
-        plan = build_baseline_plan(summary)
-        print(f"[cyan]Baseline plan: {plan}[/cyan]")
+        _print("[bold green]Step 4: Baseline pipeline plan (no orchestrator)[/bold green]")
+        plan = planner(summary)
+        _print(f"[cyan]Baseline plan: {plan}[/cyan]")
 
-    print("[bold green]Step 5: Executing plan[/bold green]")
+    _print("[bold green]Step 5: Executing plan[/bold green]")
     exec_results = execute_actions(plan, jira_mode=jira_mode, mode=mode, use_feedback=use_feedback)
 
     end_ts = time.time()
@@ -296,16 +517,24 @@ def run_full_pipeline(
         "dataset_id": dataset_id,
         "time_window": time_window,
         "config_hash": config_hash,
-        "date": datetime.utcnow().date().isoformat(),
+        "date": datetime.now(timezone.utc).date().isoformat(),
         "start_time": start_iso,
         "end_time": end_iso,
         "duration_seconds": duration_seconds,
         "llm_usage": LLM_USAGE.to_dict(),
     }
 
-    return {
+    result = {
         "meta": meta,
         "summary": summary,
         "plan": plan,
         "results": exec_results,
     }
+    if (
+            run_key is not None
+            and not exec_results.get("errors")
+            and not plan.get("llm_error")
+            and not plan.get("llm_partial")
+    ):
+        _cache_store("run", run_key, {"artifacts": _artifact_stamps(), "result": result})
+    return result
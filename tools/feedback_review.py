@@ -1,123 +1,123 @@
 # agents/feedback_review.py
 
 from typing import Dict, Any, List
-from datetime import datetime
-from pathlib import Path
-import json
+from datetime import datetime, timezone
 
 from rich import print
-from utils.file_loader import load_jira_drafts, load_feedback
-
-FEEDBACK = Path("output") / "feedback.json"
+from rich.console import Console
+from rich.text import Text
+from utils import fastjson
+from utils.file_loader import iter_jira_drafts, migrate_legacy_feedback, save_jsonl, ensure_parent_dir, FEEDBACK
+
+MAX_DESC = 600
+TRUNC_SUFFIX = " ... [truncated]"
+
+# invariant pieces of the per-draft output, built once so the review loop does not
+# re-parse the same markup for every draft
+console = Console()
+HEADER_LINE = Text("\n" + "-" * 80)
+HEADER_PANEL = "Draft for cluster idx=%s, signature=%s"
+LBL_SERVICE = Text("Service: ", style="cyan")
+LBL_CLASS = Text("Class: ", style="cyan")
+LBL_TRIAGE = Text("Triage: ", style="cyan")
+LBL_SUMMARY = Text("\nJira summary:", style="bold")
+LBL_DESC = Text("\nIssue description (truncated):", style="bold")
+PROMPT = "Approve (A) / Reject (R) / Skip all (S): "
+DECISIONS = {"a": "approved", "approve": "approved", "r": "rejected", "reject": "rejected"}
+
+def _utc_iso() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
 
 def save_feedback(entries: List[Dict[str, Any]]) -> None:
-    FEEDBACK.parent.mkdir(parents=True, exist_ok=True)
-    FEEDBACK.write_text(json.dumps(entries, indent=2), encoding="utf-8")
-
-def upsert_feedback(entry: Dict[str, Any]) -> None:
-    entries = load_feedback()
-    sig = entry.get("signature")
-    if not sig:
-        entries.append(entry)
-        save_feedback(entries)
-        return
-
-    new_entries: List[Dict[str, Any]] = []
-    replaced = False
-
-    for e in entries:
-        if e.get("signature") == sig:
-            new_entries.append(entry)
-            replaced = True
-        else:
-            new_entries.append(e)
+    save_jsonl(FEEDBACK, entries)
 
-    if not replaced:
-        new_entries.append(entry)
+def append_feedback(entry: Dict[str, Any]) -> None:
+    append_feedback_many([entry])
 
-    save_feedback(new_entries)
+def append_feedback_many(entries: List[Dict[str, Any]]) -> None:
+    # Feedback is stored as JSONL; load_feedback() keeps the latest entry per signature,
+    # so recording decisions is a single append instead of a full rewrite.
+    if not entries:
+        return
+    migrate_legacy_feedback()
+    ensure_parent_dir(FEEDBACK)
+    with FEEDBACK.open("ab") as f:
+        f.writelines(fastjson.dumps(e) + b"\n" for e in entries)
 
 def run() -> Dict[str, Any]:
-    drafts = load_jira_drafts()
-
-    if not drafts:
-        print("[yellow]No drafts found in jira_drafts.json[/yellow]")
-        return {"reviewed": 0, "written_feedback": 0}
-
     approved_indices: List[int] = []
     rejected_indices: List[int] = []
     skipped_all = False
-
-    for d in drafts:
-        idx = d.get("idx")
-        signature = d.get("signature")
-        summary = d.get("summary") or "(no summary)"
-        service = d.get("service_name") or d.get("cluster", {}).get("service_name") or "(unknown service)"
-        java_class = d.get("java_class")
-        label = d.get("cluster", {}).get("triage", {}).get("label")
-        triage = d.get("triage", {})
-        jira = d.get("jira", {})
-
-        print("\n" + "-" * 80)
-        print(f"[bold]Draft for cluster idx={idx}, signature={signature}[/bold]")
-        print(f"[cyan]Service:[/cyan] {service}")
-        print(f"[cyan]Class:[/cyan] {java_class}")
-        print(f"[cyan]Triage:[/cyan] label={triage.get('label')}, "
-              f"priority={triage.get('priority')}, severity={triage.get('severity')}, "
-              f"confidence={triage.get('confidence')}")
-        print("\n[bold]Jira summary:[/bold]")
-        print(jira.get("summary", "(no summary)"))
-        print("\n[bold]Issue description (truncated):[/bold]")
-        desc = jira.get("issue_description", "")
-        if len(desc) > 600:
-            print(desc[:600] + " ... [truncated]")
-        else:
-            print(desc)
-
-        while True:
-            choice = input("Approve (A) / Reject (R) / Skip all (S): ").strip().lower()
-            if choice in ("a", "approve"):
-                approved_indices.append(idx)
-
-                upsert_feedback(
-                    {
-                    "timestamp": datetime.utcnow().isoformat() + "Z",
-                    "signature": signature,
-                    "decision": "approved",
-                    "source": "jira_review",
-                    "summary": summary,
-                    "service": service,
+    reviewed = 0
+
+    # decisions are flushed once at the end of the session; the finally block
+    # keeps them if the review is interrupted (Ctrl-C, EOF on input)
+    pending: List[Dict[str, Any]] = []
+    try:
+        for d in iter_jira_drafts():
+            reviewed += 1
+            idx = d.get("idx")
+            signature = d.get("signature")
+            summary = d.get("summary") or "(no summary)"
+            service = d.get("service_name") or d.get("cluster", {}).get("service") or "(unknown service)"
+            java_class = d.get("java_class")
+            label = d.get("cluster", {}).get("triage", {}).get("label")
+            triage = d.get("triage", {})
+            jira = d.get("jira", {})
+
+            console.print(HEADER_LINE)
+            console.print(Text(HEADER_PANEL % (idx, signature), style="bold"))
+            console.print(Text.assemble(LBL_SERVICE, str(service)))
+            console.print(Text.assemble(LBL_CLASS, str(java_class)))
+            console.print(Text.assemble(
+                LBL_TRIAGE,
+                "label=%s, priority=%s, severity=%s, confidence=%s" % (
+                    triage.get('label'), triage.get('priority'),
+                    triage.get('severity'), triage.get('confidence')),
+            ))
+            console.print(LBL_SUMMARY)
+            console.print(jira.get("summary", "(no summary)"), markup=False)
+            console.print(LBL_DESC)
+            desc = jira.get("issue_description", "")
+            console.print(desc if len(desc) <= MAX_DESC else f"{desc[:MAX_DESC]}{TRUNC_SUFFIX}", markup=False)
+
+            ts = _utc_iso()
+
+            while True:
+                choice = input(PROMPT).strip().lower()
+                decision = DECISIONS.get(choice)
+                if decision is not None:
+                    (approved_indices if decision == "approved" else rejected_indices).append(idx)
+
+                    entry = {
+                        "timestamp": ts,
+                        "signature": signature,
+                        "decision": decision,
+                        "source": "jira_review",
+                        "summary": summary,
+                        "service": service,
                     }
-                )
+                    if decision == "rejected":
+                        entry["label"] = label
+                    pending.append(entry)
 
-                break
+                    break
 
-            elif choice in ("r", "reject"):
-                rejected_indices.append(idx)
-
-                upsert_feedback(
-                    {
-                    "timestamp": datetime.utcnow().isoformat() + "Z",
-                    "signature": signature,
-                    "decision": "rejected",
-                    "source": "jira_review",
-                    "summary": summary,
-                    "service": service,
-                    "label": label,
-                    }
-                )
+                elif choice in ("s", "skip", "skip all"):
+                    skipped_all = True
+                    print("[yellow]Skipping all remaining drafts. No Jira tickets will be created.[/yellow]")
+                    break
+                else:
+                    print("Please enter A, R, or S.")
 
+            if skipped_all:
                 break
+    finally:
+        append_feedback_many(pending)
 
-            elif choice in ("s", "skip", "skip all"):
-                skipped_all = True
-                print("[yellow]Skipping all remaining drafts. No Jira tickets will be created.[/yellow]")
-                break
-            else:
-                print("Please enter A, R, or S.")
-
-        if skipped_all:
-            break
+    if reviewed == 0:
+        print("[yellow]No Jira drafts found[/yellow]")
+        return {"reviewed": 0, "written_feedback": 0}
 
     print(f"\n[bold]Review session finished.[/bold] "
           f"Approved={len(approved_indices)}, Rejected={len(rejected_indices)}, Skipped all={skipped_all}")
@@ -1,61 +1,95 @@
 # agents/log_preprocessor.py
-import json
-from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
 from pathlib import Path
-from typing import Dict, Any, List, Tuple
+from typing import Dict, Any, Iterable, List, Tuple
 from rich import print
 
 from utils.log_source import load_logs
+from utils.file_loader import save_json, save_json_items
 
 INPUT_FILE = Path("resources") / "test_logs.json"
 RAW_LOGS_OUTPUT   = Path("output") / "raw_logs.json"
+# {"count": N} sidecar so the summary does not parse raw_logs.json just to count it
+RAW_LOGS_META     = Path("output") / "raw_logs.meta.json"
 CLUSTERS_OUTPUT    = Path("output") / "clusters.json"
 
 def _normalize(src: Dict[str, Any]) -> Dict[str, Any]:
+    get = src.get
     return {
-        "timestamp": src.get("@timestamp") or src.get("timestamp"),
-        "level": src.get("athena_level") or src.get("level"),
-        "service": src.get("AthenaServiceName") or src.get("athena_service"),
-        "message": src.get("athena_message") or src.get("log"),
-        "java_class": src.get("athena_java_class"),
-        "trace_id": src.get("athena_trace_id") or src.get("traceId"),
+        "timestamp": get("@timestamp") or get("timestamp"),
+        "level": get("athena_level") or get("level"),
+        "service": get("AthenaServiceName") or get("athena_service"),
+        "message": get("athena_message") or get("log"),
+        "java_class": get("athena_java_class"),
+        "trace_id": get("athena_trace_id") or get("traceId"),
         "raw": src,
     }
 
-def _cluster(logs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    groups: Dict[Tuple[str, str], List[Dict[str, Any]]] = defaultdict(list)
-    for e in logs:
-        k = (e.get("java_class") or "<unknown_class>", (e.get("message") or "").strip())
-        groups[k].append(e)
+# (java_class, message) -> [earliest record, timestamps in arrival order]
+Groups = Dict[Tuple[str, str], List[Any]]
 
+def _normalize_and_group(raw_logs: Iterable[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], Groups]:
+    # one pass: each record is normalized and folded into its cluster's running state,
+    # so no per-cluster record lists are kept
+    norm: List[Dict[str, Any]] = []
+    groups: Groups = {}
+    append = norm.append
+    for src in raw_logs:
+        e = _normalize(src)
+        append(e)
+        k = (e["java_class"] or "<unknown_class>", (e["message"] or "").strip())
+        ts = e["timestamp"]
+        state = groups.get(k)
+        if state is None:
+            groups[k] = [e, [ts]]
+        else:
+            state[1].append(ts)
+            # strictly earlier only, so ties keep the first record seen
+            if (ts or "") < (state[0]["timestamp"] or ""):
+                state[0] = e
+    return norm, groups
+
+def _ts_key(ts: Any) -> str:
+    return ts or ""
+
+def _cluster(groups: Groups) -> List[Dict[str, Any]]:
     clusters: List[Dict[str, Any]] = []
-    for (java_class, message), items in groups.items():
-        items_sorted = sorted(items, key=lambda x: x.get("timestamp") or "")
+    for (java_class, message), (sample, timestamps) in groups.items():
+        if len(timestamps) > 1:
+            timestamps.sort(key=_ts_key)
         clusters.append({
             "java_class": java_class,
             "message": message,
-            "count": len(items),
-            "sample": items_sorted[0],
-            "timestamps": [x.get("timestamp") for x in items_sorted],
+            "count": len(timestamps),
+            "sample": sample,
+            "timestamps": timestamps,
         })
-    clusters.sort(key=lambda c: c["count"], reverse=True)
+    clusters.sort(key=itemgetter("count"), reverse=True)
     return clusters
 
 def run(context: Dict[str, Any], source: str = "mock") -> Dict[str, Any]:
     print(f"[cyan]Loading logs (source={source})[/cyan]")
-    raw_logs = load_logs(source=source)
-    print(f"[cyan]Loaded {len(raw_logs)} raw logs[/cyan]")
-
-    norm = [_normalize(s) for s in raw_logs]
+    # may be a one-shot iterator (see load_logs); it is consumed exactly once here
+    norm, groups = _normalize_and_group(load_logs(source=source))
+    print(f"[cyan]Loaded {len(norm)} raw logs[/cyan]")
 
-    RAW_LOGS_OUTPUT.parent.mkdir(parents=True, exist_ok=True)
-    with RAW_LOGS_OUTPUT.open("w", encoding="utf-8") as f:
-        json.dump({"count": len(norm), "items": norm}, f, indent=2)
+    # raw_logs.json is written in the background while the clusters are built;
+    # _cluster only reads the normalized records
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        raw_write = pool.submit(save_json_items, RAW_LOGS_OUTPUT, norm, head={"count": len(norm)})
+        clusters = _cluster(groups)
+        raw_write.result()
+    save_json(RAW_LOGS_META, {"count": len(norm)})
     print(f"[cyan]Saved {len(norm)} normalized logs → {RAW_LOGS_OUTPUT}[/cyan]")
 
-    clusters = _cluster(norm)
-    with CLUSTERS_OUTPUT.open("w", encoding="utf-8") as f:
-        json.dump({"cluster_count": len(clusters), "log_count": len(norm), "clusters": clusters}, f, indent=2)
+    # both files are written record by record, without building one serialized blob
+    save_json_items(
+        CLUSTERS_OUTPUT,
+        clusters,
+        key="clusters",
+        head={"cluster_count": len(clusters), "log_count": len(norm)},
+    )
     print(f"[cyan]Saved {len(clusters)} clusters → {CLUSTERS_OUTPUT}[/cyan]")
 
     context = dict(context or {})
@@ -1,14 +1,52 @@
 # agents/summary.py
-import json
+from collections import Counter
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
 
-from utils.file_loader import load_triaged, _load_json
+from utils.file_loader import load_triaged, save_json, _load_json
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
 
 RAW_LOGS_PATH = Path("output") / "raw_logs.json"
+RAW_LOGS_META_PATH = Path("output") / "raw_logs.meta.json"
 SUMMARY_PATH = Path("output") / "summary.json"
 
+_ITEM_EVENTS = frozenset({"start_map", "start_array", "string", "number", "boolean", "null"})
+
+def _stream_raw_logs_count() -> int:
+    """
+    Counts raw_logs.json entries with ijson events instead of building the records.
+    The preprocessor writes {"count": N, "items": [...]}, so that header usually
+    answers before any record is read.
+    """
+    counts = {"item": 0, "logs.item": 0, "items.item": 0}
+    with open(RAW_LOGS_PATH, "rb") as f:
+        for prefix, event, value in ijson.parse(f):
+            if prefix == "count" and event == "number":
+                return int(value)
+            if prefix in counts and event in _ITEM_EVENTS:
+                counts[prefix] += 1
+    return counts["item"] or counts["logs.item"] or counts["items.item"]
+
 def _load_raw_logs_count() -> int:
+    # the preprocessor's sidecar answers without parsing the logs, unless raw_logs.json is newer
+    try:
+        if RAW_LOGS_META_PATH.stat().st_mtime_ns >= RAW_LOGS_PATH.stat().st_mtime_ns:
+            count = _load_json(RAW_LOGS_META_PATH, {}).get("count")
+            if isinstance(count, int):
+                return count
+    except (OSError, AttributeError):
+        pass
+
+    if ijson is not None:
+        try:
+            return _stream_raw_logs_count()
+        except (OSError, ijson.JSONError):
+            return 0
+
     data = _load_json(RAW_LOGS_PATH, [])
     if isinstance(data, dict):
         logs = data.get("logs") or data.get("items") or []
@@ -17,29 +55,35 @@ def _load_raw_logs_count() -> int:
         return len(data)
     return 0
 
-def build_summary() -> Dict[str, Any]:
-    triaged_items = load_triaged()
+def build_summary(
+    triaged_items: Optional[List[Dict[str, Any]]] = None,
+    log_count: Optional[int] = None,
+) -> Dict[str, Any]:
+    # callers that already hold the triaged items / log count pass them in
+    # to skip re-reading triaged.json and raw_logs.json
+    if triaged_items is None:
+        triaged_items = load_triaged()
     cluster_count = len(triaged_items)
 
-    log_count = _load_raw_logs_count()
+    if log_count is None:
+        log_count = _load_raw_logs_count()
 
-    by_label: Dict[str, int] = {}
-    by_priority: Dict[str, int] = {}
+    # one pass over the clusters; empty labels/priorities are not counted
+    label_counts: Counter = Counter()
+    priority_counts: Counter = Counter()
     internal_high_count = 0
-
     for it in triaged_items:
-        triage = it.get("triage", {})
-        label = (triage.get("label") or "").strip()
-        priority = (triage.get("priority") or "").strip()
-        severity = (triage.get("severity") or "").strip()
-
+        t = it.get("triage") or {}
+        label = (t.get("label") or "").strip()
+        priority = (t.get("priority") or "").strip()
         if label:
-            by_label[label] = by_label.get(label, 0) + 1
+            label_counts[label] += 1
         if priority:
-            by_priority[priority] = by_priority.get(priority, 0) + 1
-
-        if label == "internal_error" and priority == "high":
-            internal_high_count += 1
+            priority_counts[priority] += 1
+            if priority == "high" and label == "internal_error":
+                internal_high_count += 1
+    by_label = dict(label_counts)
+    by_priority = dict(priority_counts)
 
     summary: Dict[str, Any] = {
         "log_count": log_count,
@@ -50,7 +94,9 @@ def build_summary() -> Dict[str, Any]:
         "internal_high_count": internal_high_count,
     }
 
-    SUMMARY_PATH.parent.mkdir(parents=True, exist_ok=True)
-    SUMMARY_PATH.write_text(json.dumps(summary, indent=2), encoding="utf-8")
+    write_summary(summary)
 
     return summary
+
+def write_summary(summary: Dict[str, Any]) -> None:
+    save_json(SUMMARY_PATH, summary, indent=2)
@@ -1,16 +1,42 @@
 # utils/confluence_client.py
+import hashlib
 import os
-import json
 from typing import Optional, Dict, Any
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from rich import print
 
+from utils import fastjson
+
 CONFLUENCE_BASE_URL = os.getenv("ALOE_CONFLUENCE_URL")
 CONFLUENCE_USER = os.getenv("ALOE_CONFLUENCE_USER")
 CONFLUENCE_TOKEN = os.getenv("ALOE_CONFLUENCE_TOKEN")
 CONFLUENCE_PAGE_ID = os.getenv("ALOE_CONFLUENCE_PAGE_ID")
 
+# the update is a GET followed by a PUT on the same host; a shared session lets the
+# PUT reuse the GET's keep-alive connection instead of a second TCP+TLS handshake.
+# Retrying the PUT is safe: it carries the next version number, so a replay of an
+# already-applied update is rejected with 409 instead of appending the section twice.
+_SESSION = requests.Session()
+_SESSION.auth = (CONFLUENCE_USER, CONFLUENCE_TOKEN)
+_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=4,
+    max_retries=Retry(
+        total=3,
+        backoff_factor=0.3,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset({"GET", "PUT"}),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    ),
+))
+
+# markdown goes into a <pre> block of storage-format XHTML; one translate pass
+_XHTML_ESCAPE = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;"})
+
 def _missing_conf() -> bool:
     if not all([CONFLUENCE_BASE_URL, CONFLUENCE_USER, CONFLUENCE_TOKEN, CONFLUENCE_PAGE_ID]):
         print("[red]Confluence configuration missing (ALOE_CONFLUENCE_URL / USER / TOKEN / PAGE_ID). "
@@ -32,18 +58,17 @@ def fetch_page(mode: str = "mock") -> Optional[Dict[str, Any]]:
             + f"/rest/api/content/{CONFLUENCE_PAGE_ID}"
             + "?expand=body.storage,version"
     )
-    auth = (CONFLUENCE_USER, CONFLUENCE_TOKEN)
     headers = {"Accept": "application/json"}
 
     try:
-        resp = requests.get(url, headers=headers, auth=auth)
+        resp = _SESSION.get(url, headers=headers)
     except Exception as e:
         print(f"[red]Error calling Confluence API (GET): {e}[/red]")
         return None
 
     if 200 <= resp.status_code < 300:
         try:
-            return resp.json()
+            return fastjson.loads(resp.content)
         except Exception as e:
             print(f"[red]Failed to parse Confluence GET response JSON: {e}[/red]")
             return None
@@ -76,23 +101,26 @@ def update_confluence_page_with_markdown(
     if not isinstance(existing_body, str):
         existing_body = ""
 
-    escaped_markdown = (
-        markdown
-        .replace("&", "&amp;")
-        .replace("<", "&lt;")
-        .replace(">", "&gt;")
-    )
+    # each appended section carries a hash of its markdown; a rerun with the same
+    # markdown finds it on the page and skips the PUT (and the new page version)
+    marker = "aloe-sha256:" + hashlib.sha256(markdown.encode("utf-8")).hexdigest()
+    if marker in existing_body:
+        page_id = page.get("id") or CONFLUENCE_PAGE_ID
+        print(f"[cyan]Confluence page [bold]{page_id}[/bold] already has this section, skipping update[/cyan]")
+        return page_id
+
+    escaped_markdown = markdown.translate(_XHTML_ESCAPE)
 
     new_section = f"""
         <pre>
         {escaped_markdown}
         </pre>
+        <!--{marker}-->
         """
 
     new_body = existing_body + new_section
 
     url = CONFLUENCE_BASE_URL.rstrip("/") + f"/rest/api/content/{CONFLUENCE_PAGE_ID}"
-    auth = (CONFLUENCE_USER, CONFLUENCE_TOKEN)
     headers = {"Content-Type": "application/json"}
 
     payload = {
@@ -111,13 +139,13 @@ def update_confluence_page_with_markdown(
     }
 
     try:
-        resp = requests.put(url, headers=headers, auth=auth, data=json.dumps(payload))
+        resp = _SESSION.put(url, headers=headers, data=fastjson.dumps(payload))
     except Exception as e:
         print(f"[red]Error calling Confluence API (PUT): {e}[/red]")
         return None
 
     if 200 <= resp.status_code < 300:
-        data = resp.json()
+        data = fastjson.loads(resp.content)
         page_id = data.get("id")
         print(f"[bold green][REAL][/bold green] Updated Confluence page [bold]{page_id}[/bold]")
         return page_id
@@ -0,0 +1,73 @@
+# utils/fastjson.py
+"""
+JSON encode/decode for the hot paths (artifact files, prompts, cache keys).
+Uses orjson when it is installed and falls back to the stdlib json module
+(loads() also tries ujson before the stdlib). dumps() always returns UTF-8 bytes,
+non-ASCII characters are kept as-is.
+"""
+import json
+import mmap
+from pathlib import Path
+from typing import Any, Callable, Optional, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+def dumps(
+    obj: Any,
+    indent: bool = False,
+    sort_keys: bool = False,
+    default: Optional[Callable[[Any], Any]] = None,
+) -> bytes:
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=default, option=option)
+    return json.dumps(
+        obj,
+        ensure_ascii=False,
+        indent=2 if indent else None,
+        separators=None if indent else (",", ":"),
+        sort_keys=sort_keys,
+        default=default,
+    ).encode("utf-8")
+
+
+def dumps_str(obj: Any, indent: bool = False, sort_keys: bool = False) -> str:
+    return dumps(obj, indent=indent, sort_keys=sort_keys).decode("utf-8")
+
+
+def loads(data: Union[bytes, str]) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    if ujson is not None:
+        return ujson.loads(data)
+    return json.loads(data)
+
+
+def load_file(path: Path) -> Any:
+    """
+    Decodes a JSON file. With orjson the file is parsed straight from a read-only
+    mmap, so no bytes copy of the whole file is held next to the decoded objects.
+    """
+    if orjson is not None:
+        with open(path, "rb") as f:
+            try:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # empty file: nothing to map, let the decoder report it
+                return orjson.loads(b"")
+            with mm, memoryview(mm) as view:
+                return orjson.loads(view)
+    return loads(Path(path).read_bytes())
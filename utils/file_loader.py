@@ -1,11 +1,22 @@
-from typing import List, Dict, Any
-import json
+from typing import List, Dict, Any, Iterator, Iterable, Optional
+import os
+from functools import lru_cache
 from pathlib import Path
 
+from utils import fastjson
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
 TRIAGED = Path("output") / "triaged_logs.json"
 JIRA_DRAFTS = Path("output") / "jira_drafts.json"
+JIRA_DRAFTS_NDJSON = Path("output") / "jira_drafts.ndjson"
+JIRA_DRAFTS_SUMMARY = Path("output") / "jira_drafts.summary.json"
 FILTERS = Path("output") / "filter_suggestions.json"
-FEEDBACK = Path("output") / "feedback.json"
+FEEDBACK = Path("output") / "feedback.jsonl"
+LEGACY_FEEDBACK = Path("output") / "feedback.json"
 CLUSTERS_OUTPUT = Path("output") / "clusters.json"
 CLUSTERS_REFINED_OUTPUT = Path("output") / "clusters_refined.json"
 
@@ -13,34 +24,241 @@ def _load_json(path: Path, default: Any):
     if not path.exists():
         return default
     try:
-        return json.loads(path.read_text(encoding="utf-8"))
+        return fastjson.loads(path.read_bytes())
     except Exception:
         return default
 
+_ensured_dirs: set = set()
+
+def ensure_parent_dir(path: Path) -> None:
+    # mkdir once per directory per process instead of a stat/mkdir on every save
+    parent = path.parent
+    if parent not in _ensured_dirs:
+        parent.mkdir(parents=True, exist_ok=True)
+        _ensured_dirs.add(parent)
+
+def save_json(path: Path, obj: Any, indent: Optional[int] = None) -> None:
+    """
+    Writes obj into a sibling .tmp file and swaps it in with os.replace, so a crash
+    mid-write never leaves a truncated artifact. Compact by default (machine-read files);
+    any truthy indent gives the 2-space layout.
+    """
+    ensure_parent_dir(path)
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_bytes(fastjson.dumps(obj, indent=bool(indent)))
+    os.replace(tmp, path)
+
+def save_text(path: Path, text: str) -> None:
+    ensure_parent_dir(path)
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_bytes(text.encode("utf-8"))
+    os.replace(tmp, path)
+
+def save_jsonl(path: Path, entries: Iterable[Dict[str, Any]]) -> None:
+    ensure_parent_dir(path)
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp, "wb", buffering=1 << 20) as f:
+        for e in entries:
+            f.write(fastjson.dumps(e) + b"\n")
+    os.replace(tmp, path)
+
+def save_json_items(
+        path: Path,
+        items: Iterable[Dict[str, Any]],
+        key: str = "items",
+        ndjson: Optional[Path] = None,
+        head: Optional[Dict[str, Any]] = None,
+) -> int:
+    """
+    Streams {**head, key: [...]} item by item instead of serializing the whole list first,
+    optionally mirroring each item as a line of an NDJSON sibling. Same tmp + os.replace
+    swap as save_json. Returns the number of items written.
+    """
+    ensure_parent_dir(path)
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    nd_tmp = ndjson.with_suffix(ndjson.suffix + ".tmp") if ndjson else None
+    n = 0
+    with open(tmp, "wb", buffering=1 << 20) as f:
+        nd = open(nd_tmp, "wb", buffering=1 << 20) if nd_tmp else None
+        try:
+            f.write(b"{")
+            for k, v in (head or {}).items():
+                f.write(fastjson.dumps(k) + b":" + fastjson.dumps(v) + b",")
+            f.write(fastjson.dumps(key) + b":[")
+            for item in items:
+                raw = fastjson.dumps(item)
+                if n:
+                    f.write(b",")
+                f.write(raw)
+                if nd:
+                    nd.write(raw + b"\n")
+                n += 1
+            f.write(b"]}")
+        finally:
+            if nd:
+                nd.close()
+    os.replace(tmp, path)
+    if nd_tmp:
+        os.replace(nd_tmp, ndjson)
+    return n
+
+def _iter_ndjson(path: Path) -> Iterator[Dict[str, Any]]:
+    # one object per line; a torn last line (crash mid-write) is skipped
+    try:
+        with path.open("rb") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    obj = fastjson.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(obj, dict):
+                    yield obj
+    except OSError:
+        return
+
+@lru_cache(maxsize=8)
+def _load_json_cached(path: str, mtime_ns: int, size: int) -> Any:
+    if path.endswith(".ndjson"):
+        return list(_iter_ndjson(Path(path)))
+    return _load_json(Path(path), None)
+
+def _load_json_stamped(path: Path, default: Any):
+    """
+    Like _load_json, but memoized on (path, mtime, size): repeated loads within a run
+    are a dict lookup, and any rewrite of the file (os.replace) invalidates the entry.
+    The returned object is shared between callers and must be treated as read-only.
+    """
+    try:
+        st = path.stat()
+    except OSError:
+        return default
+    data = _load_json_cached(str(path), st.st_mtime_ns, st.st_size)
+    return default if data is None else data
+
+@lru_cache(maxsize=8)
+def _field_json_cached(path: str, mtime_ns: int, size: int, field: str) -> str:
+    data = _load_json_cached(path, mtime_ns, size)
+    if isinstance(data, list):
+        return fastjson.dumps_str(data)
+    items = data.get(field, []) if isinstance(data, dict) else []
+    return fastjson.dumps_str(items)
+
+def _field_json(path: Path, field: str) -> str:
+    """
+    Compact JSON text of one top-level list field, serialized once per file version
+    so every prompt that embeds the same artifact reuses the string.
+    """
+    try:
+        st = path.stat()
+    except OSError:
+        return "[]"
+    return _field_json_cached(str(path), st.st_mtime_ns, st.st_size, field)
+
+def clear_caches() -> None:
+    _load_json_cached.cache_clear()
+    _field_json_cached.cache_clear()
+    _load_feedback_cached.cache_clear()
+
 def load_triaged() -> List[Dict[str, Any]]:
-    data = _load_json(TRIAGED, {})
+    data = _load_json_stamped(TRIAGED, {})
     return data.get("items", [])
 
 def load_jira_drafts() -> List[Dict[str, Any]]:
-    data = _load_json(JIRA_DRAFTS, {})
+    # jira_drafts.ndjson is the current format; jira_drafts.json is read for older runs
+    if JIRA_DRAFTS_NDJSON.exists():
+        return _load_json_stamped(JIRA_DRAFTS_NDJSON, [])
+    data = _load_json_stamped(JIRA_DRAFTS, {})
     return data.get("drafts", [])
 
+def load_jira_drafts_json() -> str:
+    if JIRA_DRAFTS_NDJSON.exists():
+        return _field_json(JIRA_DRAFTS_NDJSON, "drafts")
+    return _field_json(JIRA_DRAFTS, "drafts")
+
+def iter_jira_drafts() -> Iterator[Dict[str, Any]]:
+    """
+    Yields drafts one by one without materializing the whole drafts file.
+    Legacy jira_drafts.json is streamed with ijson, or loaded whole when ijson
+    is not installed.
+    """
+    if JIRA_DRAFTS_NDJSON.exists():
+        yield from _iter_ndjson(JIRA_DRAFTS_NDJSON)
+        return
+    if ijson is None:
+        yield from load_jira_drafts()
+        return
+    if not JIRA_DRAFTS.exists():
+        return
+    try:
+        with JIRA_DRAFTS.open("rb") as f:
+            yield from ijson.items(f, "drafts.item", use_float=True)
+    except (ijson.JSONError, OSError):
+        return
+
 def load_filter() -> List[Dict[str, Any]]:
-    data = _load_json(FILTERS, {})
+    data = _load_json_stamped(FILTERS, {})
     return data.get("suggestions", [])
 
+def load_filter_json() -> str:
+    return _field_json(FILTERS, "suggestions")
+
 def load_refined_clusters() -> List[Dict[str, Any]]:
-    data = _load_json(CLUSTERS_REFINED_OUTPUT, {})
+    data = _load_json_stamped(CLUSTERS_REFINED_OUTPUT, {})
     return data.get("clusters", [])
 
 def load_clusters() -> List[Dict[str, Any]]:
-    data = _load_json(CLUSTERS_OUTPUT, {})
+    data = _load_json_stamped(CLUSTERS_OUTPUT, {})
     return data.get("clusters", [])
 
-def load_feedback() -> List[Dict[str, Any]]:
-    if not FEEDBACK.exists():
+def migrate_legacy_feedback() -> int:
+    """
+    One-shot conversion of the old feedback.json array into feedback.jsonl.
+    Does nothing once the JSONL store exists. Returns the number of migrated entries.
+    """
+    if FEEDBACK.exists() or not LEGACY_FEEDBACK.exists():
+        return 0
+
+    entries = _load_json(LEGACY_FEEDBACK, [])
+    if not isinstance(entries, list):
+        entries = []
+
+    save_jsonl(FEEDBACK, (e for e in entries if isinstance(e, dict)))
+    return len(entries)
+
+@lru_cache(maxsize=2)
+def _load_feedback_cached(mtime_ns: int, size: int) -> List[Dict[str, Any]]:
+    # The store is append-only: a later entry for the same signature replaces
+    # the earlier one but keeps its original position.
+    by_key: Dict[Any, Dict[str, Any]] = {}
+    try:
+        with FEEDBACK.open("rb") as f:
+            for n, line in enumerate(f):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = fastjson.loads(line)
+                except ValueError:
+                    continue
+                if not isinstance(entry, dict):
+                    continue
+                by_key[entry.get("signature") or n] = entry
+    except OSError:
         return []
+    return list(by_key.values())
+
+def load_feedback() -> List[Dict[str, Any]]:
+    """
+    Latest feedback entry per signature. Parsed once per file version (every append
+    changes the size), so the executor, orchestrator and enrichers share one read.
+    The returned list is shared and must be treated as read-only. Never writes:
+    a legacy feedback.json is converted by migrate_legacy_feedback() at startup.
+    """
     try:
-        return json.loads(FEEDBACK.read_text(encoding="utf-8"))
-    except Exception:
-        return []
\ No newline at end of file
+        st = FEEDBACK.stat()
+    except OSError:
+        return []
+    return _load_feedback_cached(st.st_mtime_ns, st.st_size)
@@ -1,19 +1,64 @@
 # utils/jira_client.py
 import os
-import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Optional, Dict, Any, List
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from rich import print
 
+from utils import fastjson
+
 JIRA_BASE_URL = os.getenv("ALOE_JIRA_URL")
 JIRA_PROJECT_KEY = os.getenv("ALOE_JIRA_PROJECT")
 JIRA_USER = os.getenv("ALOE_JIRA_USER")
 JIRA_TOKEN = os.getenv("ALOE_JIRA_TOKEN")
 
-def create_jira_issues(drafts: List[Dict[str, Any]], mode: str = "mock") -> Optional[str]:
-    for draft in drafts:
-        create_jira_issue_from_draft(draft, mode)
+JIRA_MAX_WORKERS = int(os.getenv("ALOE_JIRA_MAX_WORKERS", "8"))
+
+# One keep-alive pool shared by every worker, sized to the worker count, so concurrent
+# POSTs reuse TCP+TLS connections. Issue creation is not idempotent, so only failures
+# where Jira cannot have created the issue are retried: connection errors (nothing was
+# sent) and 429. Read timeouts and resets after the body went out are not retried
+# (read=0, other=0), and neither is 503, which a gateway can return after the backend
+# has already committed the issue.
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=JIRA_MAX_WORKERS,
+    pool_maxsize=JIRA_MAX_WORKERS,
+    max_retries=Retry(
+        total=3,
+        read=0,
+        other=0,
+        backoff_factor=0.5,
+        status_forcelist=(429,),
+        allowed_methods=frozenset({"POST"}),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    ),
+))
+
+_PROJECT_FIELD = {"key": JIRA_PROJECT_KEY}
+_ISSUETYPE_FIELD = {"name": "Bug"}
+
+def create_jira_issues(drafts: List[Dict[str, Any]], mode: str = "mock") -> List[Optional[str]]:
+    if mode == "mock" or len(drafts) <= 1:
+        return [create_jira_issue_from_draft(draft, mode) for draft in drafts]
+
+    keys: List[Optional[str]] = [None] * len(drafts)
+    with ThreadPoolExecutor(max_workers=min(JIRA_MAX_WORKERS, len(drafts))) as ex:
+        # submit everything first, then collect, so the POSTs actually overlap
+        futures = {
+            ex.submit(create_jira_issue_from_draft, draft, mode): i
+            for i, draft in enumerate(drafts)
+        }
+        for fut in as_completed(futures):
+            try:
+                keys[futures[fut]] = fut.result()
+            except Exception as e:
+                print(f"[red]Error creating Jira issue: {e}[/red]")
+    return keys
 
 def create_jira_issue_from_draft(draft: Dict[str, Any], mode: str = "mock") -> Optional[str]:
     summary = draft.get("jira").get("summary") or "Log issue..."
@@ -37,21 +82,21 @@ def create_jira_issue_from_draft(draft: Dict[str, Any], mode: str = "mock") -> O
 
     payload = {
         "fields": {
-            "project": {"key": JIRA_PROJECT_KEY},
+            "project": _PROJECT_FIELD,
             "summary": summary,
             "description": description,
-            "issuetype": {"name": "Bug"},
+            "issuetype": _ISSUETYPE_FIELD,
         }
     }
 
     try:
-        resp = requests.post(url, headers=headers, auth=auth, data=json.dumps(payload))
+        resp = _SESSION.post(url, headers=headers, auth=auth, data=fastjson.dumps(payload))
     except Exception as e:
         print(f"[red]Error calling Jira API: {e}[/red]")
         return None
 
     if 200 <= resp.status_code < 300:
-        data = resp.json()
+        data = fastjson.loads(resp.content)
         key = data.get("key")
         print(f"[bold green][REAL][/bold green] Created Jira issue [bold]{key}[/bold] for draft: {summary}")
         return key
@@ -1,13 +1,39 @@
 # utils/llm.py
 import os
-import json
 import time
-from typing import Any, Dict, Optional
+import atexit
+import asyncio
+import hashlib
+import re
+import string
+from collections import OrderedDict
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
+import httpx
 from dotenv import load_dotenv, find_dotenv
-from groq import Groq
+from groq import Groq, AsyncGroq
 
-from utils.metrics import LLM_USAGE
+try:
+    import jiter
+except ImportError:
+    jiter = None
+
+try:
+    import fastjsonschema
+except ImportError:
+    fastjsonschema = None
+
+try:
+    import h2  # noqa: F401  (lets httpx negotiate HTTP/2)
+    _HTTP2 = True
+except ImportError:
+    _HTTP2 = False
+
+from utils import fastjson
+from utils.file_loader import save_json
+from utils.metrics import add_cache_hit, add_usage
 
 load_dotenv(".env.local")
 env_path = find_dotenv()
@@ -20,81 +46,564 @@ if not api_key:
 
 model_name = os.getenv("GROQ_MODEL", "llama-3.1-8b-instant")
 
-client = Groq(api_key=api_key)
+# upper bound on in-flight requests for ask_json_many, to stay under provider rate limits
+LLM_MAX_CONCURRENCY = int(os.getenv("ALOE_LLM_CONCURRENCY", "10"))
+# retries are left to the SDK: 429/5xx/connection errors, exponential backoff with
+# jitter, and the server's Retry-After when it sends one
+LLM_MAX_RETRIES = int(os.getenv("ALOE_LLM_RETRIES", "5"))
 
+# Successful responses are stored under their prompt hash, so re-running on unchanged
+# input skips the network round-trip. Disabled with ALOE_LLM_CACHE=0 or set_llm_cache(False).
+LLM_CACHE_DIR = Path("output") / ".llm_cache"
+LLM_CACHE_ENABLED = os.getenv("ALOE_LLM_CACHE", "1") != "0"
+# Entries expire after ALOE_LLM_CACHE_TTL seconds unless a caller asks for a shorter
+# max_age, and the directory is kept under ALOE_LLM_CACHE_MAX_MB by dropping the oldest
+# entries. Both are enforced by a sweep on the first write and every _PRUNE_EVERY writes.
+LLM_CACHE_TTL = float(os.getenv("ALOE_LLM_CACHE_TTL", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_BYTES = int(os.getenv("ALOE_LLM_CACHE_MAX_MB", "1024")) * 1024 * 1024
+_PRUNE_EVERY = 256
+_puts_until_prune = 0
+# Recent entries are also kept in process (as serialized bytes, so callers can mutate
+# what they get back), so repeated prompts within one run skip the file read too.
+LLM_MEM_CACHE_SIZE = int(os.getenv("ALOE_LLM_MEM_CACHE", "1024"))
+_MEM_CACHE: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
 
-def ask_json(system_prompt: str, user_prompt: str, model: Optional[str] = None) -> Dict[str, Any]:
-    m = model or model_name
+# Offline runs can submit their prompts as one provider Batch API job instead (discounted,
+# separate rate limits, but completes asynchronously). Enabled with ALOE_LLM_BATCH=1 or
+# set_llm_batch(True); only callers that use ask_json_batch are affected.
+LLM_BATCH_ENABLED = os.getenv("ALOE_LLM_BATCH", "0") == "1"
+LLM_BATCH_POLL_SECONDS = float(os.getenv("ALOE_LLM_BATCH_POLL", "10"))
+LLM_BATCH_TIMEOUT = float(os.getenv("ALOE_LLM_BATCH_TIMEOUT", str(24 * 3600)))
+_BATCH_ACTIVE = ("validating", "in_progress", "finalizing")
+
+# One keep-alive pool for every call in the process, so agents running back to back
+# (and the filter/triage batches) reuse connections instead of redoing TCP+TLS.
+_HTTP_TIMEOUT = httpx.Timeout(120.0, connect=10.0)
+_HTTP_LIMITS = httpx.Limits(max_connections=LLM_MAX_CONCURRENCY * 2, max_keepalive_connections=20)
+
+client = Groq(
+    api_key=api_key,
+    max_retries=LLM_MAX_RETRIES,
+    http_client=httpx.Client(http2=_HTTP2, timeout=_HTTP_TIMEOUT, limits=_HTTP_LIMITS),
+)
+# close the pooled connections cleanly instead of leaving them to interpreter teardown
+atexit.register(client.close)
 
-    for attempt in range(5):
+
+def new_async_client() -> AsyncGroq:
+    # async HTTP clients are bound to the event loop they first run on, so every
+    # ask_json_many() call opens its own instead of sharing a module-level one
+    return AsyncGroq(
+        api_key=api_key,
+        max_retries=LLM_MAX_RETRIES,
+        http_client=httpx.AsyncClient(http2=_HTTP2, timeout=_HTTP_TIMEOUT, limits=_HTTP_LIMITS),
+    )
+
+
+def set_llm_cache(enabled: bool) -> None:
+    global LLM_CACHE_ENABLED
+    LLM_CACHE_ENABLED = enabled
+
+
+def prune_llm_cache(max_age: Optional[float] = None, max_bytes: Optional[int] = None) -> int:
+    """
+    Deletes output/.llm_cache entries older than max_age (default LLM_CACHE_TTL), then the
+    oldest remaining ones until the directory fits in max_bytes (default
+    LLM_CACHE_MAX_BYTES). Returns the number of entries removed.
+    """
+    max_age = LLM_CACHE_TTL if max_age is None else max_age
+    max_bytes = LLM_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    now = time.time()
+    entries: List[Tuple[float, int, Path]] = []
+    removed = 0
+    for path in LLM_CACHE_DIR.glob("*.json"):
         try:
-            resp = client.chat.completions.create(
-                model=m,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": system_prompt + "\nYou MUST respond with ONLY a valid JSON object. No markdown, no explanation.",
-                    },
-                    {"role": "user", "content": user_prompt},
-                ],
-                temperature=0.1,
-                stream=False,
-            )
-
-            usage = getattr(resp, "usage", None)
-            if usage is not None:
-                # OpenAI style: usage.prompt_tokens, usage.completion_tokens
-                prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
-                completion_tokens = getattr(usage, "completion_tokens", 0) or 0
-
-                if prompt_tokens is None and isinstance(usage, dict):
-                    prompt_tokens = usage.get("prompt_tokens", 0)
-                if completion_tokens is None and isinstance(usage, dict):
-                    completion_tokens = usage.get("completion_tokens", 0)
-
-                prompt_tokens = prompt_tokens or 0
-                completion_tokens = completion_tokens or 0
-
-                LLM_USAGE.prompt_tokens += prompt_tokens
-                LLM_USAGE.completion_tokens += completion_tokens
-                LLM_USAGE.calls += 1
-
-            content = resp.choices[0].message.content or ""
-            text = content.strip()
-
-            import json
+            st = path.stat()
+            if now - st.st_mtime > max_age:
+                path.unlink()
+                removed += 1
+                continue
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    if total > max_bytes:
+        entries.sort()
+        for _, size, path in entries:
+            if total <= max_bytes:
+                break
+            try:
+                path.unlink()
+                removed += 1
+            except OSError:
+                pass
+            total -= size
+    return removed
+
+
+def reset_llm_cache(remove_files: bool = False) -> None:
+    """Drops the in-process cache tier; with remove_files, the output/.llm_cache entries too."""
+    _MEM_CACHE.clear()
+    if remove_files:
+        for path in LLM_CACHE_DIR.glob("*.json"):
             try:
-                return json.loads(text)
-            except json.JSONDecodeError:
-                if text.startswith("```"):
-                    lines = text.splitlines()
-                    if len(lines) >= 2:
-                        inner = "\n".join(lines[1:-1]).strip()
-                    else:
-                        inner = text
-                    try:
-                        return json.loads(inner)
-                    except json.JSONDecodeError:
-                        pass
-
-                if "{" in text and "}" in text:
-                    inner = text[text.find("{"): text.rfind("}") + 1]
-                    try:
-                        return json.loads(inner)
-                    except json.JSONDecodeError:
-                        pass
-
-                print(f"[red]Groq returned non-JSON:[/red] {text[:200]}...")
-                return {"_error": "json_parse_failed", "_raw": text}
-
-        except Exception as e:
-            msg = str(e)
-            if "429" in msg or "rate limit" in msg.lower():
-                wait = 2 ** attempt
-                print(f"[yellow]Groq rate limited: {msg} – retrying in {wait}s[/yellow]")
-                time.sleep(wait)
+                path.unlink()
+            except OSError:
+                pass
+
+
+def set_llm_batch(enabled: bool) -> None:
+    global LLM_BATCH_ENABLED
+    LLM_BATCH_ENABLED = enabled
+
+
+def batch_enabled() -> bool:
+    return LLM_BATCH_ENABLED
+
+
+def cache_key(*parts: Any) -> str:
+    return hashlib.blake2b(fastjson.dumps(parts, sort_keys=True), digest_size=16).hexdigest()
+
+
+def _mem_put(key: str, stored_at: float, data: bytes) -> None:
+    if LLM_MEM_CACHE_SIZE <= 0:
+        return
+    _MEM_CACHE[key] = (stored_at, data)
+    _MEM_CACHE.move_to_end(key)
+    if len(_MEM_CACHE) > LLM_MEM_CACHE_SIZE:
+        _MEM_CACHE.popitem(last=False)
+
+
+def cache_get(key: Optional[str], max_age: Optional[float] = None) -> Optional[Any]:
+    if key is None or not LLM_CACHE_ENABLED:
+        return None
+    if max_age is None or max_age > LLM_CACHE_TTL:
+        max_age = LLM_CACHE_TTL
+    hit = _MEM_CACHE.get(key)
+    if hit is not None and time.time() - hit[0] <= max_age:
+        _MEM_CACHE.move_to_end(key)
+        add_cache_hit()
+        return fastjson.loads(hit[1])
+    path = LLM_CACHE_DIR / f"{key}.json"
+    try:
+        stored_at = path.stat().st_mtime
+        if time.time() - stored_at > max_age:
+            return None
+        data = path.read_bytes()
+        value = fastjson.loads(data)
+    except (OSError, ValueError):
+        return None
+    _mem_put(key, stored_at, data)
+    add_cache_hit()
+    return value
+
+
+def cache_put(key: Optional[str], value: Any) -> None:
+    if key is None or not LLM_CACHE_ENABLED:
+        return
+    if isinstance(value, dict) and (value.get("_error") or value.get("_partial")):
+        return
+    global _puts_until_prune
+    _mem_put(key, time.time(), fastjson.dumps(value))
+    try:
+        save_json(LLM_CACHE_DIR / f"{key}.json", value)
+    except OSError:
+        return
+    _puts_until_prune -= 1
+    if _puts_until_prune < 0:
+        _puts_until_prune = _PRUNE_EVERY
+        prune_llm_cache()
+
+
+def split_template(template: str) -> List[Tuple[str, Optional[str]]]:
+    """
+    Pre-parses a str.format-style prompt template into (literal, field) pairs once,
+    so fill_template() only joins strings instead of re-scanning the template per call.
+    Escaped braces ({{ }}) are unescaped here, same as str.format would.
+    """
+    return [(literal, field) for literal, field, _, _ in string.Formatter().parse(template)]
+
+
+def fill_template(parts: List[Tuple[str, Optional[str]]], **values: str) -> str:
+    chunks: List[str] = []
+    for literal, field in parts:
+        chunks.append(literal)
+        if field is not None:
+            chunks.append(values[field])
+    return "".join(chunks)
+
+
+def truncate_items(items: List[Any], max_chars: int) -> Tuple[str, int]:
+    """
+    Compact JSON of the longest prefix of items that fits in max_chars, and how many
+    items were left out. Binary search keeps it at O(log n) serializations.
+    """
+    text = fastjson.dumps_str(items)
+    if len(text) <= max_chars:
+        return text, 0
+
+    lo, hi = 0, len(items) - 1
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if len(fastjson.dumps_str(items[:mid])) <= max_chars:
+            lo = mid
+        else:
+            hi = mid - 1
+    return fastjson.dumps_str(items[:lo]), len(items) - lo
+
+
+def _messages(system_prompt: str, user_prompt: str) -> List[Dict[str, str]]:
+    return [
+        {
+            "role": "system",
+            "content": system_prompt + "\nYou MUST respond with ONLY a valid JSON object. No markdown, no explanation.",
+        },
+        {"role": "user", "content": user_prompt},
+    ]
+
+
+def _record_usage(resp: Any) -> None:
+    usage = getattr(resp, "usage", None)
+    if usage is not None:
+        # OpenAI style: usage.prompt_tokens, usage.completion_tokens
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+
+        if prompt_tokens is None and isinstance(usage, dict):
+            prompt_tokens = usage.get("prompt_tokens", 0)
+        if completion_tokens is None and isinstance(usage, dict):
+            completion_tokens = usage.get("completion_tokens", 0)
+
+        prompt_tokens = prompt_tokens or 0
+        completion_tokens = completion_tokens or 0
+
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = getattr(details, "cached_tokens", 0) or 0
+
+        add_usage(prompt_tokens, completion_tokens, cached_tokens)
+
+
+def _parse_content(resp: Any) -> Dict[str, Any]:
+    return _parse_text(resp.choices[0].message.content or "")
+
+
+def _chunk_usage(chunk: Any) -> Any:
+    # Groq reports usage in x_groq.usage of the final chunk; OpenAI-style streams in usage
+    return getattr(getattr(chunk, "x_groq", None), "usage", None) or getattr(chunk, "usage", None)
+
+
+def _read_json_stream(stream: Any) -> str:
+    """
+    Collects streamed content until the first top-level JSON object closes. Braces inside
+    strings are ignored. Anything after the object is discarded without being scanned,
+    but the stream is still read to its end, since token usage only arrives in the
+    final chunk. Returns everything received if the object never closes.
+    """
+    parts: List[str] = []
+    usage = None
+    depth = 0
+    in_str = escaped = False
+    text: Optional[str] = None
+    try:
+        for chunk in stream:
+            usage = _chunk_usage(chunk) or usage
+            if text is not None or not chunk.choices:
                 continue
-            print(f"[red]Groq error: {msg}[/red]")
-            return {"_error": msg}
+            delta = chunk.choices[0].delta.content or ""
+            for i, ch in enumerate(delta):
+                if in_str:
+                    if escaped:
+                        escaped = False
+                    elif ch == "\\":
+                        escaped = True
+                    elif ch == '"':
+                        in_str = False
+                elif ch == '"':
+                    in_str = True
+                elif ch == "{":
+                    depth += 1
+                elif ch == "}" and depth > 0:
+                    depth -= 1
+                    if depth == 0:
+                        parts.append(delta[: i + 1])
+                        text = "".join(parts)
+                        break
+            if text is None:
+                parts.append(delta)
+        return text if text is not None else "".join(parts)
+    finally:
+        close = getattr(stream, "close", None)
+        if close is not None:
+            close()
+        if usage is not None:
+            _record_usage(SimpleNamespace(usage=usage))
+        else:
+            add_usage()
+
+
+# leading ```/```json fence; the body ends at the first closing fence, so trailing
+# commentary after the block is ignored
+_FENCE_RE = re.compile(r"```(?:json)?\s*(.*?)\s*```", re.S)
+
+
+def _parse_text(content: str) -> Dict[str, Any]:
+    text = content.strip()
+
+    # pick the candidate span up front so well-formed replies (bare or fenced) are
+    # decoded exactly once instead of after failed attempts on the wrapper
+    body = text
+    if text.startswith("```"):
+        m = _FENCE_RE.match(text)
+        if m:
+            body = m.group(1)
+
+    if body[:1] in ("{", "["):
+        try:
+            return fastjson.loads(body)
+        except ValueError:
+            pass
+
+    # prose around the object, or trailing text after it
+    start, end = body.find("{"), body.rfind("}")
+    if 0 <= start < end and (start, end) != (0, len(body) - 1):
+        try:
+            return fastjson.loads(body[start:end + 1])
+        except ValueError:
+            pass
+
+    # Truncated output (hit max tokens, unterminated string or object): jiter's
+    # partial mode keeps everything up to the cut instead of dropping the response.
+    # The last value may itself be cut off, so the result is flagged _partial and
+    # never cached.
+    if jiter is not None and start >= 0:
+        try:
+            partial = jiter.from_json(body[start:].encode("utf-8"), partial_mode="trailing-strings")
+            if isinstance(partial, dict) and partial:
+                partial["_partial"] = True
+                return partial
+        except ValueError:
+            pass
+
+    print(f"[red]Groq returned non-JSON:[/red] {text[:200]}...")
+    return {"_error": "json_parse_failed", "_raw": text}
+
+
+# compiled fastjsonschema validators by id(schema); the schema is kept alongside so
+# its id cannot be reused by another dict
+_VALIDATORS: Dict[int, Tuple[Dict[str, Any], Callable[[Any], Any]]] = {}
+
+
+def _check_schema(out: Dict[str, Any], schema: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Validates a fresh response against schema (when fastjsonschema is installed).
+    A mismatch is returned as an _error result, so it is not cached.
+    """
+    if schema is None or fastjsonschema is None or out.get("_error"):
+        return out
+    entry = _VALIDATORS.get(id(schema))
+    if entry is None or entry[0] is not schema:
+        entry = _VALIDATORS[id(schema)] = (schema, fastjsonschema.compile(schema))
+    try:
+        entry[1](out)
+    except fastjsonschema.JsonSchemaException as e:
+        print(f"[red]LLM response does not match schema: {e.message}[/red]")
+        return {"_error": f"schema: {e.message}", "_raw": out}
+    return out
+
+
+def ask_json(
+    system_prompt: str,
+    user_prompt: str,
+    model: Optional[str] = None,
+    cache: bool = True,
+    max_age: Optional[float] = None,
+    stream: bool = False,
+    schema: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    m = model or model_name
+    key = cache_key(m, system_prompt, user_prompt) if cache else None
+    out = cache_get(key, max_age=max_age)
+    if out is None:
+        out = _check_schema(_request_json(system_prompt, user_prompt, m, stream=stream), schema)
+        cache_put(key, out)
+    return out
+
 
-    return {"_error": "max_retries_exceeded"}
\ No newline at end of file
+def _request_json(system_prompt: str, user_prompt: str, m: str, stream: bool = False) -> Dict[str, Any]:
+    try:
+        resp = client.chat.completions.create(
+            model=m,
+            messages=_messages(system_prompt, user_prompt),
+            temperature=0.1,
+            stream=stream,
+        )
+        if stream:
+            return _parse_text(_read_json_stream(resp))
+        _record_usage(resp)
+        return _parse_content(resp)
+    except Exception as e:
+        # raised once the SDK's own retries are used up, or for non-retryable errors
+        print(f"[red]Groq error: {e}[/red]")
+        return {"_error": str(e)}
+
+
+async def ask_json_async(
+    async_client: AsyncGroq,
+    system_prompt: str,
+    user_prompt: str,
+    model: Optional[str] = None,
+    cache: bool = True,
+    max_age: Optional[float] = None,
+    schema: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    m = model or model_name
+    key = cache_key(m, system_prompt, user_prompt) if cache else None
+    out = cache_get(key, max_age=max_age)
+    if out is None:
+        out = _check_schema(await _request_json_async(async_client, system_prompt, user_prompt, m), schema)
+        cache_put(key, out)
+    return out
+
+
+async def _request_json_async(
+    async_client: AsyncGroq,
+    system_prompt: str,
+    user_prompt: str,
+    m: str,
+) -> Dict[str, Any]:
+    try:
+        resp = await async_client.chat.completions.create(
+            model=m,
+            messages=_messages(system_prompt, user_prompt),
+            temperature=0.1,
+            stream=False,
+        )
+        _record_usage(resp)
+        return _parse_content(resp)
+    except Exception as e:
+        print(f"[red]Groq error: {e}[/red]")
+        return {"_error": str(e)}
+
+
+def ask_json_many(
+    system_prompt: str,
+    user_prompts: List[str],
+    model: Optional[str] = None,
+    max_concurrency: Optional[int] = None,
+    cache: bool = True,
+    max_age: Optional[float] = None,
+    schema: Optional[Dict[str, Any]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Sends one request per user prompt concurrently (bounded by LLM_MAX_CONCURRENCY)
+    and returns the parsed responses in the same order as user_prompts.
+    Must be called from synchronous code (agents run in worker threads).
+    """
+    if len(user_prompts) <= 1:
+        return [
+            ask_json(system_prompt, u, model=model, cache=cache, max_age=max_age, schema=schema)
+            for u in user_prompts
+        ]
+
+    async def _gather() -> List[Dict[str, Any]]:
+        sem = asyncio.Semaphore(max_concurrency or LLM_MAX_CONCURRENCY)
+        async with new_async_client() as aclient:
+
+            async def _one(user_prompt: str) -> Dict[str, Any]:
+                async with sem:
+                    return await ask_json_async(
+                        aclient, system_prompt, user_prompt, model=model, cache=cache, max_age=max_age,
+                        schema=schema)
+
+            return await asyncio.gather(*(_one(u) for u in user_prompts))
+
+    return asyncio.run(_gather())
+
+
+def ask_json_batch(
+    system_prompt: str,
+    user_prompts: List[str],
+    model: Optional[str] = None,
+    cache: bool = True,
+    max_age: Optional[float] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Like ask_json_many, but uncached prompts are sent as a single Batch API job and
+    polled until it finishes. Anything the job does not return (submission error,
+    failed/expired job, timeout, missing line) is retried through ask_json_many.
+    """
+    m = model or model_name
+    keys = [cache_key(m, system_prompt, u) if cache else None for u in user_prompts]
+    results: List[Optional[Dict[str, Any]]] = [cache_get(k, max_age=max_age) for k in keys]
+    pending = {str(i): u for i, u in enumerate(user_prompts) if results[i] is None}
+
+    if pending:
+        for cid, out in _run_batch_job(system_prompt, pending, m).items():
+            i = int(cid)
+            results[i] = out
+            cache_put(keys[i], out)
+
+    missing = [i for i, r in enumerate(results) if r is None]
+    if missing:
+        retried = ask_json_many(
+            system_prompt, [user_prompts[i] for i in missing], model=model, cache=cache, max_age=max_age)
+        for i, out in zip(missing, retried):
+            results[i] = out
+    return results
+
+
+def _run_batch_job(system_prompt: str, prompts: Dict[str, str], m: str) -> Dict[str, Dict[str, Any]]:
+    # custom_id -> parsed response; an empty dict means the caller falls back to live requests
+    lines = b"".join(
+        fastjson.dumps({
+            "custom_id": cid,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {"model": m, "messages": _messages(system_prompt, u), "temperature": 0.1},
+        }) + b"\n"
+        for cid, u in prompts.items()
+    )
+    try:
+        upload = client.files.create(file=("aloe_batch.jsonl", lines), purpose="batch")
+        job = client.batches.create(
+            input_file_id=upload.id, endpoint="/v1/chat/completions", completion_window="24h")
+        print(f"[cyan]Submitted Groq batch {job.id} ({len(prompts)} requests)[/cyan]")
+
+        deadline = time.monotonic() + LLM_BATCH_TIMEOUT
+        while job.status in _BATCH_ACTIVE:
+            if time.monotonic() > deadline:
+                print(f"[yellow]Groq batch {job.id} timed out – falling back to live requests[/yellow]")
+                try:
+                    client.batches.cancel(job.id)
+                except Exception:
+                    pass
+                return {}
+            time.sleep(LLM_BATCH_POLL_SECONDS)
+            job = client.batches.retrieve(job.id)
+
+        if job.status != "completed" or not job.output_file_id:
+            print(f"[yellow]Groq batch {job.id} ended as {job.status} – falling back to live requests[/yellow]")
+            return {}
+        raw = client.files.content(job.output_file_id).read()
+    except Exception as e:
+        print(f"[red]Groq batch error: {e}[/red]")
+        return {}
+
+    out: Dict[str, Dict[str, Any]] = {}
+    for line in raw.splitlines():
+        try:
+            rec = fastjson.loads(line)
+        except ValueError:
+            continue
+        body = (rec.get("response") or {}).get("body") or {}
+        choices = body.get("choices") or []
+        if rec.get("custom_id") not in prompts or not choices:
+            continue
+        usage = body.get("usage") or {}
+        _record_usage(SimpleNamespace(usage=SimpleNamespace(
+            prompt_tokens=usage.get("prompt_tokens", 0),
+            completion_tokens=usage.get("completion_tokens", 0),
+        )))
+        out[rec["custom_id"]] = _parse_text((choices[0].get("message") or {}).get("content") or "")
+    return out
@@ -1,21 +1,77 @@
 # agents/log_source.py
 from __future__ import annotations
 
-import json
 import os
+from functools import lru_cache
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterable, Iterator, List, Optional
 
 from rich import print
 
+from utils import fastjson
+
 try:
-    from elasticsearch import Elasticsearch
+    import ijson
+except ImportError:
+    ijson = None
+
+try:
+    from elasticsearch import Elasticsearch, helpers
 except ImportError:
     Elasticsearch = None
+    helpers = None
 
-def load_logs_from_file(path: Path) -> List[Dict[str, Any]]:
-    with path.open("r", encoding="utf-8") as f:
-        es_data = json.load(f)
+# hand Elasticsearch hits to the caller as they are paged in instead of as one list
+LOG_STREAM = os.getenv("ALOE_LOG_STREAM", "0") == "1"
+# "time": newest first via PIT + search_after; "none": index order via a _doc-sorted
+# scroll, cheaper for the cluster when the order of hits does not matter
+LOG_ORDER = os.getenv("ALOE_ES_ORDER", "time")
+# _source fields the pipeline reads (log_preprocessor._normalize, plus "log" for triage's
+# stack excerpt); only these are requested from Elasticsearch. ALOE_ES_FULL_SOURCE=1
+# fetches whole documents instead, e.g. to keep them in raw_logs.json.
+LOG_SOURCE_FIELDS = [
+    "@timestamp", "timestamp",
+    "athena_level", "level",
+    "AthenaServiceName", "athena_service",
+    "athena_message", "log",
+    "athena_java_class",
+    "athena_trace_id", "traceId",
+]
+LOG_FULL_SOURCE = os.getenv("ALOE_ES_FULL_SOURCE", "0") == "1"
+# ES exports above this size are streamed hit by hit (needs ijson) instead of decoded whole
+LOG_FILE_STREAM_BYTES = int(os.getenv("ALOE_LOG_FILE_STREAM_MB", "100")) * 1024 * 1024
+
+def _iter_hits_file(path: Path) -> Iterator[Dict[str, Any]]:
+    with open(path, "rb") as f:
+        for h in ijson.items(f, "hits.hits.item", use_float=True):
+            yield h.get("_source", {}) or {}
+
+_JSONL_SUFFIXES = (".jsonl", ".ndjson")
+
+def _iter_jsonl(path: Path) -> Iterator[Dict[str, Any]]:
+    # one log document (or one ES hit) per line; blank lines are skipped
+    with open(path, "rb") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            doc = fastjson.loads(line)
+            if "_source" in doc:
+                doc = doc["_source"] or {}
+            yield doc
+
+def load_logs_from_file(path: Path) -> Iterable[Dict[str, Any]]:
+    """
+    Returns the _source of every hit in an ES search export. Exports larger than
+    ALOE_LOG_FILE_STREAM_MB come back as a one-shot iterator when ijson is installed;
+    .jsonl/.ndjson files (one document per line) always do.
+    """
+    if path.suffix.lower() in _JSONL_SUFFIXES:
+        return _iter_jsonl(path)
+    if ijson is not None and path.stat().st_size > LOG_FILE_STREAM_BYTES:
+        return _iter_hits_file(path)
+    # ES exports can be large; orjson (when installed) decodes the mapped file much faster
+    es_data = fastjson.load_file(path)
     hits = es_data.get("hits", {}).get("hits", [])
     return [h.get("_source", {}) or {} for h in hits]
 
@@ -25,6 +81,21 @@ except ImportError:
     Elasticsearch = None
 
 
+@lru_cache(maxsize=4)
+def _get_client(es_url: str, username: str | None, password: str | None):
+    # one client (and connection pool) per cluster/credentials for the whole process
+    es_kwargs: Dict[str, Any] = {
+        "hosts": [es_url],
+        # log documents are repetitive JSON; gzip cuts response bytes substantially
+        "http_compress": True,
+        "request_timeout": 60,
+        "retry_on_timeout": True,
+    }
+    if username and password:
+        es_kwargs["basic_auth"] = (username, password)
+    return Elasticsearch(**es_kwargs)
+
+
 def _ensure_last_24h_range(query: Dict[str, Any]) -> Dict[str, Any]:
     """
     Ensures the query contains @timestamp range now-1d..now.
@@ -64,13 +135,23 @@ def _ensure_last_24h_range(query: Dict[str, Any]) -> Dict[str, Any]:
 
     return q
 
-def load_logs_from_elasticsearch(
+def iter_logs_from_elasticsearch(
         es_url: str,
         index: str,
         username: str | None = None,
         password: str | None = None,
         size: int = 1000,
-) -> List[Dict[str, Any]]:
+        order: str = "time",
+        fields: Optional[List[str]] = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Yields the _source of every hit page by page (PIT + search_after, newest first),
+    so only one page of hits is held at a time. The PIT is closed when the generator
+    is exhausted or closed. order="none" scrolls in _doc order instead; fields limits
+    the returned _source to those keys.
+    """
+    if order not in ("time", "none"):
+        raise ValueError(f"Unknown log order: {order}")
     if Elasticsearch is None:
         raise RuntimeError(
             "Elasticsearch client not installed. "
@@ -85,26 +166,32 @@ def load_logs_from_elasticsearch(
     if not query_file.exists():
         raise FileNotFoundError("Missing resources/elastic_query.json")
 
-    query = json.loads(query_file.read_text(encoding="utf-8"))
+    query = fastjson.loads(query_file.read_bytes())
     query = _ensure_last_24h_range(query)
+    if fields:
+        query["_source"] = list(fields)
+
+    if order == "none":
+        yield from _scan_unordered(es_url, index, username, password, query, size)
+        return
 
     query["sort"] = [
         {"@timestamp": {"order": "desc"}},
         {"_shard_doc": {"order": "desc"}}
     ]
     query["size"] = size
+    # the hit total is never read; skips counting every match (not allowed with scroll,
+    # so only set on this path)
+    query["track_total_hits"] = False
 
     print(f"[cyan]Connecting to Elasticsearch at {es_url}[/cyan]")
-    es_kwargs: Dict[str, Any] = {"hosts": [es_url]}
-    if username and password:
-        es_kwargs["basic_auth"] = (username, password)
-    es = Elasticsearch(**es_kwargs)
+    es = _get_client(es_url, username, password)
 
     print(f"[cyan]Opening PIT for index '{index}'[/cyan]")
     pit = es.open_point_in_time(index=index, keep_alive="2m")
     pit_id = pit["id"]
 
-    logs: List[Dict[str, Any]] = []
+    fetched = 0
     search_after: Optional[List[Any]] = None
 
     try:
@@ -115,21 +202,22 @@ def load_logs_from_elasticsearch(
             if search_after is not None:
                 body["search_after"] = search_after
 
-            resp = es.search(body=body)
+            # only the fields the loop reads; skips _index/_id/_score etc. per hit
+            resp = es.search(body=body, filter_path=["hits.hits._source", "hits.hits.sort"])
             hits = resp.get("hits", {}).get("hits", [])
             if not hits:
                 break
 
+            fetched += len(hits)
             for h in hits:
-                logs.append(h.get("_source", {}) or {})
+                yield h.get("_source", {}) or {}
 
             search_after = hits[-1].get("sort")
             if not search_after:
                 # If sort values are missing, pagination can't continue safely
                 break
 
-        print(f"[green]Fetched {len(logs)} logs from Elasticsearch (last 24h)[/green]")
-        return logs
+        print(f"[green]Fetched {fetched} logs from Elasticsearch (last 24h)[/green]")
 
     finally:
         try:
@@ -137,7 +225,45 @@ def load_logs_from_elasticsearch(
         except Exception:
             pass
 
-def load_logs(source: str = "mock") -> List[Dict[str, Any]]:
+def _scan_unordered(
+        es_url: str,
+        index: str,
+        username: str | None,
+        password: str | None,
+        query: Dict[str, Any],
+        size: int,
+) -> Iterator[Dict[str, Any]]:
+    query.pop("sort", None)
+    query.pop("size", None)
+
+    print(f"[cyan]Connecting to Elasticsearch at {es_url}[/cyan]")
+    es = _get_client(es_url, username, password)
+
+    print(f"[cyan]Scrolling index '{index}' in index order[/cyan]")
+    fetched = 0
+    # preserve_order=False sorts by _doc: no scoring and no sort heap on the shards
+    for h in helpers.scan(es, query=query, index=index, size=size, scroll="2m", preserve_order=False):
+        fetched += 1
+        yield h.get("_source", {}) or {}
+
+    print(f"[green]Fetched {fetched} logs from Elasticsearch (last 24h)[/green]")
+
+def load_logs_from_elasticsearch(
+        es_url: str,
+        index: str,
+        username: str | None = None,
+        password: str | None = None,
+        size: int = 1000,
+        order: str = "time",
+        fields: Optional[List[str]] = None,
+) -> List[Dict[str, Any]]:
+    return list(iter_logs_from_elasticsearch(es_url, index, username, password, size, order, fields))
+
+def load_logs(source: str = "mock") -> Iterable[Dict[str, Any]]:
+    """
+    May return a lazy iterator (single pass) instead of a list: for the elastic
+    source with ALOE_LOG_STREAM=1, and for JSONL or large mock files.
+    """
     source = source.lower()
 
     if source == "mock":
@@ -150,11 +276,14 @@ def load_logs(source: str = "mock") -> List[Dict[str, Any]]:
         es_username = os.getenv("ALOE_ES_USERNAME")
         es_password = os.getenv("ALOE_ES_PASSWORD")
 
-        return load_logs_from_elasticsearch(
+        load = iter_logs_from_elasticsearch if LOG_STREAM else load_logs_from_elasticsearch
+        return load(
             es_url=es_url,
             index=es_index,
             username=es_username,
             password=es_password,
+            order=LOG_ORDER,
+            fields=None if LOG_FULL_SOURCE else LOG_SOURCE_FIELDS,
         )
 
     raise ValueError(f"Unknown log source: {source}")
@@ -1,5 +1,6 @@
 # utils/metrics.py
 
+import threading
 from dataclasses import dataclass, asdict
 
 @dataclass
@@ -7,6 +8,12 @@ class LlmUsage:
     prompt_tokens: int = 0
     completion_tokens: int = 0
     calls: int = 0
+    # prompt tokens served from the provider's prefix cache (subset of prompt_tokens)
+    cached_prompt_tokens: int = 0
+    # responses served from output/.llm_cache without a request
+    cache_hits: int = 0
+    # orchestrator plans decided without an LLM call (nothing left to review)
+    fast_path_plans: int = 0
 
     @property
     def total_tokens(self) -> int:
@@ -19,8 +26,35 @@ class LlmUsage:
 
 
 LLM_USAGE = LlmUsage()
+# agents run on worker threads (executor uses asyncio.to_thread), so the
+# read-modify-write updates below go through one lock to avoid lost counts
+_LOCK = threading.Lock()
+
+def add_usage(
+    prompt_tokens: int = 0,
+    completion_tokens: int = 0,
+    cached_prompt_tokens: int = 0,
+    calls: int = 1,
+) -> None:
+    with _LOCK:
+        LLM_USAGE.prompt_tokens += prompt_tokens
+        LLM_USAGE.completion_tokens += completion_tokens
+        LLM_USAGE.cached_prompt_tokens += cached_prompt_tokens
+        LLM_USAGE.calls += calls
+
+def add_cache_hit() -> None:
+    with _LOCK:
+        LLM_USAGE.cache_hits += 1
+
+def add_fast_path_plan() -> None:
+    with _LOCK:
+        LLM_USAGE.fast_path_plans += 1
 
 def reset_llm_usage() -> None:
-    LLM_USAGE.prompt_tokens = 0
-    LLM_USAGE.completion_tokens = 0
-    LLM_USAGE.calls = 0
+    with _LOCK:
+        LLM_USAGE.prompt_tokens = 0
+        LLM_USAGE.completion_tokens = 0
+        LLM_USAGE.calls = 0
+        LLM_USAGE.cached_prompt_tokens = 0
+        LLM_USAGE.cache_hits = 0
+        LLM_USAGE.fast_path_plans = 0